@@ -0,0 +1,233 @@
+import time
+import numpy as np
+from backends import attach_model, load_model, resolve_model
+from metrics import metrics
+
+SAMPLE_RATE = 16000
+
+def audio_seconds(audio):
+    if isinstance(audio, dict):
+        return len(audio["raw"]) / audio.get("sampling_rate", SAMPLE_RATE)
+    return 0.0  # a file path; its length is unknown until decoded
+
+def _timed_iter(iterator, stage):
+    # the ASR pipeline's preprocess is a generator: time the work behind each chunk
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            metrics.observe_stage(stage, time.perf_counter() - start)
+        yield item
+
+def instrument(pipe, model):
+    # per-stage timings inside the pipeline: feature extraction, encoder, each
+    # decoder step (one generated token per sequence) and text postprocessing
+    preprocess, postprocess = pipe.preprocess, pipe.postprocess
+
+    def timed_preprocess(*args, **kwargs):
+        return _timed_iter(iter(preprocess(*args, **kwargs)), "feature_extraction")
+
+    def timed_postprocess(*args, **kwargs):
+        with metrics.span("postprocess"):
+            return postprocess(*args, **kwargs)
+
+    pipe.preprocess, pipe.postprocess = timed_preprocess, timed_postprocess
+
+    def add_timing_hooks(module, stage, count_tokens=False):
+        started = []
+
+        def before(module, args, kwargs):
+            started.append(time.perf_counter())
+
+        def after(module, args, kwargs, output):
+            metrics.observe_stage(stage, time.perf_counter() - started.pop())
+            if count_tokens:
+                inputs = kwargs.get("input_ids", args[0] if args else None)
+                if inputs is not None:
+                    metrics.count("tokens_generated", inputs.shape[0])
+
+        module.register_forward_pre_hook(before, with_kwargs=True)
+        module.register_forward_hook(after, with_kwargs=True)
+
+    add_timing_hooks(model.get_encoder(), "encoder")
+    add_timing_hooks(model.get_decoder(), "decoder_step", count_tokens=True)
+
+def cancel_criteria(tokens, per_row):
+    # stops generation once jobs are cancelled or past their deadline; each row
+    # stops on its own when rows map to jobs one to one, else only once all expired
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class Cancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            expired = [token is not None and token.expired() for token in tokens]
+            if per_row and input_ids.shape[0] == len(tokens):
+                return torch.tensor(expired, dtype=torch.bool, device=input_ids.device)
+            return torch.full((input_ids.shape[0],), all(expired), dtype=torch.bool, device=input_ids.device)
+
+    return StoppingCriteriaList([Cancelled()])
+
+class SpeechRecognizer:
+    """Owns the Whisper model and the ASR pipeline for the lifetime of the engine.
+
+    torch and transformers are only imported by `load`, so importing this module
+    is cheap and the engine can bind its socket before the model exists. The
+    backend (see backends.py) picks the precision the model runs in.
+
+    With an `assistant_id`, a small checkpoint sharing the tokenizer drafts
+    tokens that the main model verifies in one forward pass (assisted
+    generation). The output is the main model's greedy output, with fewer of its
+    decoder passes. transformers only supports this for one sequence at a time,
+    so batches are decoded one chunk after the other.
+    """
+
+    def __init__(self, model_id, backend="auto", device=None, chunk_length_s=30, assistant_id=None):
+        self.model_id = resolve_model(model_id)
+        self.assistant_id = resolve_model(assistant_id) if assistant_id else None
+        self.assistant = None
+        self.backend = backend
+        self.device = device
+        self.torch_dtype = None
+        self.chunk_length_s = chunk_length_s
+        self.model = None
+        self.processor = None
+        self.pipe = None
+        self.timings = {}
+        # real-time factor: compute time over audio time, from every call so far
+        self.audio_s = 0.0
+        self.compute_s = 0.0
+
+    def load(self, shared=None, shared_assistant=None):
+        # shared: weights another process already loaded (backends.share_model)
+        start = time.perf_counter()
+        import torch
+        from transformers import AutoProcessor, pipeline
+        self.timings["import"] = time.perf_counter() - start
+        if self.device is None:
+            self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+        start = time.perf_counter()
+        if shared is not None:
+            self.model = attach_model(shared)
+            self.torch_dtype = self.model.dtype
+        else:
+            self.model, self.backend, self.torch_dtype = load_model(self.model_id, self.backend, self.device)
+        if shared_assistant is not None:
+            self.assistant = attach_model(shared_assistant)
+        elif self.assistant_id:
+            self.assistant, _, _ = load_model(self.assistant_id, self.backend, self.device)
+        self.processor = AutoProcessor.from_pretrained(self.model_id)
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=self.model,
+            tokenizer=self.processor.tokenizer,
+            feature_extractor=self.processor.feature_extractor,
+            torch_dtype=self.torch_dtype,
+            chunk_length_s=self.chunk_length_s,
+            device=self.device,
+            return_timestamps=True,
+        )
+        instrument(self.pipe, self.model)
+        self.timings["load"] = time.perf_counter() - start
+        return self
+
+    def warm_up(self, seconds=1.0, language="en"):
+        # one pass over synthetic silence so kernels, caches and allocators are
+        # initialised before the first real request arrives
+        silence = np.zeros(int(SAMPLE_RATE * seconds), dtype=np.float32)
+        start = time.perf_counter()
+        self.transcribe({"raw": silence, "sampling_rate": SAMPLE_RATE}, language)
+        self.timings["warm_up"] = time.perf_counter() - start
+        # the warm-up says nothing about steady-state speed
+        self.audio_s = self.compute_s = 0.0
+        return self
+
+    def rtf(self):
+        return self.compute_s / self.audio_s if self.audio_s else None
+
+    def transcribe(self, audio, language=None, text_only=True):
+        if self.pipe is None:
+            raise RuntimeError("Model is not loaded")
+        seconds = audio_seconds(audio)  # measured first, the pipeline consumes the dict
+        start = time.perf_counter()
+        result = self.pipe(audio, generate_kwargs=self._generate_kwargs(language))
+        self._account(seconds, time.perf_counter() - start)
+        return result["text"] if text_only else result
+
+    def transcribe_batch(self, audios, language=None, tokens=None):
+        # tokens (see scheduler.CancelToken) are checked between decoder steps
+        if self.pipe is None:
+            raise RuntimeError("Model is not loaded")
+        generate_kwargs = self._generate_kwargs(language)
+        if tokens and any(token is not None for token in tokens):
+            if all(token is not None and token.expired() for token in tokens):
+                raise RuntimeError("Every job in the batch was cancelled")
+            generate_kwargs.update(self._cancel_kwargs(audios, tokens))
+        seconds = sum(audio_seconds(audio) for audio in audios)
+        start = time.perf_counter()
+        # one batched generate over the 30 s chunks of every utterance
+        batch_size = 1 if self.assistant is not None else len(audios)
+        results = self.pipe(audios, batch_size=batch_size, generate_kwargs=generate_kwargs)
+        self._account(seconds, time.perf_counter() - start)
+        return results
+
+    def _generate_kwargs(self, language):
+        generate_kwargs = {"language": language}
+        if self.assistant is not None:
+            generate_kwargs["assistant_model"] = self.assistant
+        return generate_kwargs
+
+    def _cancel_kwargs(self, audios, tokens):
+        # with every utterance in a single chunk, the batch rows are the utterances in order
+        per_row = all(audio_seconds(audio) <= self.chunk_length_s for audio in audios)
+        return {"stopping_criteria": cancel_criteria(tokens, per_row)}
+
+    def _account(self, audio_s, compute_s):
+        self.audio_s += audio_s
+        self.compute_s += compute_s
+        metrics.count("audio_seconds", audio_s)
+        metrics.observe_stage("inference", compute_s)
+
+class StubRecognizer(SpeechRecognizer):
+    """Deterministic stand-in for benchmarks: sleeps `rtf` seconds per second of audio.
+
+    Needs neither torch nor model weights, so the engine's own overhead can be
+    measured in isolation.
+    """
+
+    def __init__(self, rtf=0.05, chunk_length_s=30):
+        super().__init__("stub", "stub", "cpu", chunk_length_s)
+        self.stub_rtf = rtf
+
+    def load(self, shared=None, shared_assistant=None):
+        self.timings["import"] = 0.0
+        self.timings["load"] = 0.0
+        self.pipe = self._pipe
+        return self
+
+    def _cancel_kwargs(self, audios, tokens):
+        return {"tokens": tokens}
+
+    def _pipe(self, audio, batch_size=None, generate_kwargs=None):
+        audios = audio if isinstance(audio, list) else [audio]
+        seconds = [audio_seconds(item) for item in audios]
+        tokens = (generate_kwargs or {}).get("tokens")
+        # a batch costs as much as its longest member, like a padded batched generate;
+        # sleep in steps so cancellation cuts it short like the real stopping criteria
+        deadline = time.perf_counter() + self.stub_rtf * max(seconds, default=0.0)
+        while time.perf_counter() < deadline:
+            if tokens and all(token is not None and token.expired() for token in tokens):
+                break
+            time.sleep(min(0.01, max(0.0, deadline - time.perf_counter())))
+        results = [{"text": f" {length:.2f} seconds of audio",
+                    "chunks": [{"text": f" {length:.2f} seconds of audio", "timestamp": (0.0, length)}]}
+                   for length in seconds]
+        return results if isinstance(audio, list) else results[0]
+
+def make_recognizer(model_id, backend="auto", stub_rtf=0.05, assistant_id=None):
+    if model_id == "stub" or model_id.startswith("stub:"):
+        return StubRecognizer(float(model_id[5:]) if model_id[5:] else stub_rtf)
+    return SpeechRecognizer(model_id, backend, assistant_id=assistant_id)
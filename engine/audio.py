@@ -0,0 +1,249 @@
+import asyncio
+import sys
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # S16_LE
+READ_BYTES = 3200  # 100 ms of 16 kHz mono S16_LE
+
+class RingBuffer:
+    """Preallocated float32 ring addressed by absolute sample positions."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.end = 0  # absolute position one past the newest sample
+
+    @property
+    def start(self):
+        # oldest sample still held; anything before it has been overwritten
+        return max(0, self.end - self.capacity)
+
+    def write(self, samples):
+        self._write(samples, 1.0)
+
+    def write_pcm16(self, data):
+        # convert straight into the ring, no intermediate float array
+        self._write(np.frombuffer(data, dtype="<i2"), 1.0 / 32768.0)
+
+    def _write(self, samples, scale):
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.end += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        pos = self.end % self.capacity
+        first = min(n, self.capacity - pos)
+        np.multiply(samples[:first], scale, out=self.buffer[pos:pos + first], casting="unsafe")
+        if first < n:
+            np.multiply(samples[first:], scale, out=self.buffer[:n - first], casting="unsafe")
+        self.end += n
+
+    def read(self, start, end=None):
+        end = self.end if end is None else min(end, self.end)
+        start = max(start, self.start)
+        if start >= end:
+            return np.zeros(0, dtype=np.float32)
+        i = start % self.capacity
+        j = i + (end - start)
+        if j <= self.capacity:
+            return self.buffer[i:j].copy()
+        return np.concatenate((self.buffer[i:], self.buffer[:j - self.capacity]))
+
+class ArecordSource:
+    """Raw 16 kHz mono S16_LE PCM from arecord's stdout."""
+
+    def __init__(self, device="pipewire"):
+        self.device = device
+        self.process = None
+
+    async def open(self):
+        cmd = ["arecord", f"--device={self.device}", "-q", "-t", "raw",
+               "-f", "S16_LE", "-r", str(SAMPLE_RATE), "-c", "1"]
+        self.process = await asyncio.create_subprocess_exec(cmd[0], *cmd[1:], stdout=asyncio.subprocess.PIPE)
+
+    async def read(self, size):
+        return await self.process.stdout.read(size)
+
+    async def close(self):
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+class FileSource:
+    """PCM from a WAV/raw file, or stdin when path is "-", for running without PipeWire.
+
+    Raw input must already be 16 kHz mono S16_LE. With realtime=True reads are
+    paced like a live microphone.
+    """
+
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.file = None
+        self.closed = False
+        # reads block, stdin possibly for good: keep them off the loop's shared default executor
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture")
+
+    async def open(self):
+        self.closed = False
+        if self.path == "-":
+            self.file = sys.stdin.buffer
+            return
+        self.file = open(self.path, "rb")
+        if self.file.read(4) == b"RIFF":
+            self.file.seek(0)
+            params = wave.open(self.file).getparams()
+            if (params.framerate, params.nchannels, params.sampwidth) != (SAMPLE_RATE, 1, SAMPLE_WIDTH):
+                raise ValueError(f"{self.path}: expected 16 kHz mono S16_LE, got {params}")
+            # wave.open leaves the file positioned at the first frame
+        else:
+            self.file.seek(0)
+
+    async def read(self, size):
+        if self.closed:
+            return b""
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self.executor, self.file.read, size)
+        if self.realtime and data:
+            await asyncio.sleep(len(data) / (SAMPLE_RATE * SAMPLE_WIDTH))
+        return data
+
+    async def close(self):
+        self.closed = True
+        if self.file and self.file is not sys.stdin.buffer:
+            self.file.close()
+            self.file = None
+        self.executor.shutdown(wait=False)
+
+def make_source(spec, device="pipewire", realtime=False):
+    # "arecord", "file:<path>" or "-" for stdin
+    if spec == "arecord":
+        return ArecordSource(device)
+    if spec == "-":
+        return FileSource("-", realtime)
+    if spec.startswith("file:"):
+        return FileSource(spec[len("file:"):], realtime)
+    raise ValueError(f"Unknown capture source: {spec}")
+
+class StreamResampler:
+    """Linear-interpolation resampler that carries its phase across frames.
+
+    Frames from one stream can be resampled one at a time without clicks at
+    frame boundaries. Downsampling is not low-pass filtered first, which is fine
+    for speech from 16-48 kHz microphones.
+    """
+
+    def __init__(self, in_rate, out_rate=SAMPLE_RATE):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.step = in_rate / out_rate
+        self.last = None  # final sample of the previous frame
+        self.pos = 0.0  # next output position, in input samples from the start of the frame
+
+    def process(self, samples):
+        if self.in_rate == self.out_rate or len(samples) == 0:
+            return samples
+        if self.last is not None:
+            samples = np.concatenate(([self.last], samples))
+        limit = len(samples) - 1
+        count = int(np.floor((limit - self.pos) / self.step)) + 1 if limit >= self.pos else 0
+        positions = self.pos + self.step * np.arange(count)
+        out = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+        # the last sample is kept and prepended to the next frame, so shift by one less
+        self.pos = self.pos + self.step * count - limit
+        self.last = samples[-1]
+        return out
+
+class Recorder:
+    """Pumps a PCM source into a ring buffer for the duration of one recording."""
+
+    def __init__(self, source, ring):
+        self.source = source
+        self.ring = ring
+        self.start_pos = ring.end
+        self.task = None
+        self.remainder = b""
+        self.listeners = []  # called after each write, e.g. a VAD segmenter
+
+    async def start(self):
+        self.start_pos = self.ring.end
+        await self.source.open()
+        self.task = asyncio.create_task(self._pump())
+        return self
+
+    async def _pump(self):
+        while True:
+            data = await self.source.read(READ_BYTES)
+            if not data:
+                break
+            if self.remainder:
+                data = self.remainder + data
+                self.remainder = b""
+            if len(data) % SAMPLE_WIDTH:
+                self.remainder = data[-1:]
+                data = data[:-1]
+            self.ring.write_pcm16(data)
+            for listener in self.listeners:
+                listener()
+
+    async def stop(self, read=True):
+        await self.source.close()
+        if self.task:
+            try:
+                await self.task
+            except ValueError:  # reading from a file closed under us
+                pass
+        if not read:
+            return None  # the audio was already taken out of the ring, e.g. by ChunkedRecording
+        if self.start_pos < self.ring.start:
+            print(f"Recording exceeded the {self.ring.capacity / SAMPLE_RATE:.0f}s capture buffer, "
+                  "oldest audio was dropped")
+        return self.audio()
+
+    def audio(self):
+        return self.ring.read(self.start_pos)
+
+class ClientRecorder:
+    """Recording fed by audio frames the client streams over the socket."""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.start_pos = ring.end
+        self.resampler = None
+        self.listeners = []
+
+    async def start(self):
+        self.start_pos = self.ring.end
+        return self
+
+    def feed(self, sample_rate, pcm):
+        if sample_rate == SAMPLE_RATE and self.resampler is None:
+            self.ring.write_pcm16(pcm)
+        else:
+            if self.resampler is None or self.resampler.in_rate != sample_rate:
+                self.resampler = StreamResampler(sample_rate)
+            samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+            self.ring.write(self.resampler.process(samples))
+        for listener in self.listeners:
+            listener()
+
+    async def stop(self, read=True):
+        return self.audio() if read else None
+
+    def audio(self):
+        return self.ring.read(self.start_pos)
+
+def load_wav(path):
+    # whole WAV file as 16 kHz mono float32, for fixtures and benchmarks
+    with wave.open(path) as wav:
+        if wav.getsampwidth() != SAMPLE_WIDTH:
+            raise ValueError(f"{path}: expected 16 bit samples")
+        rate, channels = wav.getframerate(), wav.getnchannels()
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+    samples = pcm.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    return StreamResampler(rate).process(samples).astype(np.float32, copy=False)
@@ -0,0 +1,85 @@
+# Inference backends: which checkpoint runs, in which precision, on which device.
+#   fp32  full precision, works everywhere
+#   fp16  half precision, CUDA only
+#   bf16  bfloat16, CUDA or CPUs with native bf16 (AVX512-BF16/AMX)
+#   int8  fp32 model with every Linear layer dynamically quantized to int8, CPU only
+#   auto  fp16 on CUDA, fp32 otherwise
+
+BACKENDS = ("auto", "fp32", "fp16", "bf16", "int8")
+
+# short names for the Whisper checkpoints we run; anything else is used as a model id as is
+MODELS = {
+    "tiny": "openai/whisper-tiny",
+    "base": "openai/whisper-base",
+    "small": "openai/whisper-small",
+    "medium": "openai/whisper-medium",
+    "large-v3": "openai/whisper-large-v3",
+    "large-v3-turbo": "openai/whisper-large-v3-turbo",
+    "distil-small": "distil-whisper/distil-small.en",
+    "distil-medium": "distil-whisper/distil-medium.en",
+    "distil-large-v3": "distil-whisper/distil-large-v3",
+}
+
+def resolve_model(name):
+    return MODELS.get(name, name)
+
+def bf16_supported(torch, device):
+    if device.startswith("cuda"):
+        return torch.cuda.is_bf16_supported()
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def resolve(torch, backend, device):
+    # returns (backend, dtype the weights are loaded in)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}")
+    cuda = device.startswith("cuda")
+    if backend == "auto":
+        backend = "fp16" if cuda else "fp32"
+    if backend == "fp16" and not cuda:
+        raise ValueError("The fp16 backend needs a CUDA device")
+    if backend == "bf16" and not bf16_supported(torch, device):
+        raise ValueError(f"bfloat16 is not supported on {device}")
+    if backend == "int8" and cuda:
+        raise ValueError("The int8 backend runs on CPU only")
+    dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(backend, torch.float32)
+    return backend, dtype
+
+def load_model(model_id, backend, device):
+    import torch
+    from transformers import AutoModelForSpeechSeq2Seq
+    backend, dtype = resolve(torch, backend, device)
+    model = AutoModelForSpeechSeq2Seq.from_pretrained(
+        model_id, torch_dtype=dtype, low_cpu_mem_usage=True, use_safetensors=True)
+    model.to(device)
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model, backend, dtype
+
+def share_model(model, backend):
+    # moves the weights into shared memory; the returned (config, generation config, state dict)
+    # pickles to worker processes as handles to the same memory, not as copies
+    if backend == "int8":
+        raise ValueError("int8 models cannot be shared across worker processes")
+    model.share_memory()
+    return model.config, model.generation_config, model.state_dict()
+
+def attach_model(shared):
+    # rebuilds a model around shared weights without allocating any of its own
+    import torch
+    from transformers import AutoModelForSpeechSeq2Seq
+    model_config, generation_config, state = shared
+    with torch.device("meta"):
+        model = AutoModelForSpeechSeq2Seq.from_config(model_config, torch_dtype=next(iter(state.values())).dtype)
+    model.load_state_dict(state, assign=True)
+    # from_config only has generation defaults: the checkpoint's carries Whisper's timestamp
+    # and language tokens, without which generate rejects return_timestamps and language
+    model.generation_config = generation_config
+    missing = [name for name, tensor in [*model.named_parameters(), *model.named_buffers()] if tensor.is_meta]
+    if missing:
+        raise ValueError(f"Shared weights are missing {', '.join(missing)}")
+    model.eval()
+    return model
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import config
+from asr import make_recognizer
+from audio import SAMPLE_RATE, SAMPLE_WIDTH, StreamResampler
+
+# Offline transcription of recorded files with the engine's model, for backfills:
+#   python batch.py meetings/ interview.wav --output-dir transcripts --batch-size 16
+# A process pool decodes and cuts the audio into chunks of at most 30 s while the
+# model transcribes earlier chunks, batch_size chunks per pipeline call, so the
+# device never waits on ffmpeg. Transcripts are written as the batches finish;
+# finished files are skipped when the command is run again.
+
+EXTENSIONS = (".wav", ".flac", ".mp3", ".m4a", ".ogg", ".opus", ".webm", ".mp4", ".mkv")
+
+def find_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.lower().endswith(EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def duration(path):
+    if path.lower().endswith(".wav"):
+        with wave.open(path) as wav:
+            return wav.getnframes() / wav.getframerate()
+    out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip())
+
+def probe(path):
+    try:
+        return duration(path), None
+    except (OSError, ValueError, EOFError, wave.Error, subprocess.CalledProcessError) as e:
+        return None, str(e) or type(e).__name__
+
+def read_audio(path, offset_s, length_s):
+    # [offset_s, offset_s + length_s) as 16 kHz mono float32
+    if path.lower().endswith(".wav"):
+        with wave.open(path) as wav:
+            if wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"{path}: expected 16 bit samples")
+            rate, channels = wav.getframerate(), wav.getnchannels()
+            wav.setpos(min(wav.getnframes(), int(offset_s * rate)))
+            pcm = np.frombuffer(wav.readframes(int(length_s * rate)), dtype="<i2")
+        samples = pcm.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+        return StreamResampler(rate).process(samples).astype(np.float32, copy=False)
+    pcm = subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-ss", str(offset_s), "-t", str(length_s),
+                          "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+                         capture_output=True, check=True).stdout
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+
+def decode_block(path, start_s, end_s, total_s, chunk_s, search_s):
+    """Decodes [start_s, end_s) of a file and cuts it into chunks; runs in the pool.
+
+    Chunk boundaries sit at the quietest 30 ms within `search_s` before every
+    multiple of chunk_s - search_s, so no chunk exceeds chunk_s. The boundary at
+    the start of a block is found from the same audio as the end of the previous
+    block, so consecutive blocks meet exactly, without words cut in two.
+    """
+    lead = min(search_s, start_s)
+    audio = read_audio(path, start_s - lead, end_s - start_s + lead)
+    base = start_s - lead  # file time of audio[0]
+    frame = SAMPLE_RATE * 30 // 1000
+
+    def cut(target_s):
+        if target_s <= 0:
+            return 0
+        if target_s >= total_s:
+            return len(audio)
+        hi = min(len(audio), int(round((target_s - base) * SAMPLE_RATE)))
+        lo = max(0, hi - int(search_s * SAMPLE_RATE))
+        count = (hi - lo) // frame
+        if count == 0:
+            return hi
+        frames = audio[lo:lo + count * frame].reshape(count, frame)
+        return lo + int(np.argmin(np.einsum("ij,ij->i", frames, frames))) * frame + frame // 2
+
+    step = chunk_s - search_s
+    targets = list(np.arange(start_s, end_s - 1e-6, step)) + [end_s]
+    bounds = [cut(target) for target in targets]
+    if end_s >= total_s:
+        bounds[-1] = len(audio)
+    return [(base + first / SAMPLE_RATE, audio[first:last])
+            for first, last in zip(bounds, bounds[1:]) if last > first]
+
+class Transcript:
+    """Output of one input file, appended to while its chunks are transcribed."""
+
+    def __init__(self, source, path, fmt, blocks):
+        self.source = source
+        self.path = path
+        self.fmt = fmt
+        self.blocks_left = blocks  # blocks not decoded yet
+        self.chunks_left = 0  # decoded chunks not transcribed yet
+        self.audio_s = 0.0
+        self.started = time.perf_counter()
+        self.failed = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path + ".part", "w")
+
+    def write(self, offset_s, result):
+        for chunk in result.get("chunks") or [{"text": result["text"], "timestamp": (0.0, None)}]:
+            start, end = chunk["timestamp"]
+            start = offset_s + (start or 0.0)
+            end = offset_s + end if end is not None else None
+            text = chunk["text"].strip()
+            if not text:
+                continue
+            if self.fmt == "jsonl":
+                self.file.write(json.dumps({"start": round(start, 2),
+                                            "end": round(end, 2) if end is not None else None,
+                                            "text": text}) + "\n")
+            else:
+                self.file.write(f"[{timestamp(start)} -> {timestamp(end)}] {text}\n")
+
+    def done(self):
+        return self.blocks_left == 0 and self.chunks_left == 0
+
+    def close(self):
+        self.file.close()
+        if self.failed:
+            os.remove(self.path + ".part")
+        else:
+            os.replace(self.path + ".part", self.path)
+
+def timestamp(seconds):
+    if seconds is None:
+        return "--:--:--.-"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes // 60):02d}:{int(minutes % 60):02d}:{seconds:04.1f}"
+
+def output_path(source, roots, output_dir, fmt):
+    # mirror the input tree below output_dir; without one, write next to the input
+    if output_dir is None:
+        return os.path.splitext(source)[0] + "." + fmt
+    for root in roots:
+        if os.path.isdir(root) and os.path.commonpath([os.path.abspath(root), os.path.abspath(source)]) == os.path.abspath(root):
+            relative = os.path.relpath(source, root)
+            break
+    else:
+        relative = os.path.basename(source)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + "." + fmt)
+
+def decoded_blocks(pool, jobs, prefetch):
+    # jobs decode in the pool in parallel but are handed out in order
+    jobs = iter(jobs)
+    pending = deque()
+    for job in jobs:
+        pending.append((job[0], pool.submit(decode_block, *job)))
+        if len(pending) >= prefetch:
+            break
+    while pending:
+        source, future = pending.popleft()
+        for job in jobs:
+            pending.append((job[0], pool.submit(decode_block, *job)))
+            break
+        try:
+            chunks, error = future.result(), None
+        except Exception as e:
+            chunks, error = None, e
+        yield source, chunks, error
+
+def main(args):
+    files = list(dict.fromkeys(find_files(args.paths)))
+    transcripts, jobs = {}, []
+    block_s = (args.chunk_s - args.search_s) * args.batch_size
+    # the pool is forked before the model loads, so workers stay small and torch-free
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for source, (total, error) in zip(files, pool.map(probe, files)):
+            if error or not total:
+                print(f"{source}: {error or 'no audio'}, skipped")
+                continue
+            path = output_path(source, args.paths, args.output_dir, args.format)
+            if os.path.exists(path) and not args.overwrite:
+                print(f"{source}: {path} exists, skipped")
+                continue
+            starts = np.arange(0.0, total, block_s)
+            transcripts[source] = Transcript(source, path, args.format, len(starts))
+            jobs.extend((source, start, min(total, start + block_s), total, args.chunk_s, args.search_s)
+                        for start in starts)
+        if not jobs:
+            return
+
+        recognizer = make_recognizer(args.model, args.backend, config.stub_rtf).load()
+        print(f"Model {recognizer.model_id} ({recognizer.backend}) loaded on {recognizer.device} "
+              f"in {recognizer.timings['load']:.2f}s")
+        started = time.perf_counter()
+        batch = []
+
+        def flush():
+            results = recognizer.transcribe_batch([{"raw": audio, "sampling_rate": SAMPLE_RATE}
+                                                   for _, _, audio in batch], args.language)
+            for (transcript, offset, _), result in zip(batch, results):
+                transcript.write(offset, result)
+                transcript.chunks_left -= 1
+            for transcript in {transcript for transcript, _, _ in batch}:
+                transcript.file.flush()
+                finish(transcript)
+            batch.clear()
+
+        def finish(transcript):
+            if transcript.file.closed or not transcript.done():
+                return
+            transcript.close()
+            del transcripts[transcript.source]
+            elapsed = time.perf_counter() - transcript.started
+            if not transcript.failed:
+                print(f"{transcript.source}: {transcript.audio_s:.1f}s of audio in {elapsed:.1f}s -> {transcript.path}")
+
+        for source, chunks, error in decoded_blocks(pool, jobs, args.workers * 2):
+            transcript = transcripts[source]
+            transcript.blocks_left -= 1
+            if error is not None:
+                print(f"{source}: {error}")
+                transcript.failed = True
+            elif not transcript.failed:
+                for offset, audio in chunks:
+                    transcript.chunks_left += 1
+                    transcript.audio_s += len(audio) / SAMPLE_RATE
+                    batch.append((transcript, offset, audio))
+                    if len(batch) >= args.batch_size:
+                        flush()
+            finish(transcript)
+        if batch:
+            flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"Transcribed {recognizer.audio_s:.1f}s of audio in {elapsed:.1f}s "
+          f"(rtf {recognizer.rtf() or 0.0:.3f})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe recorded audio files or directories of them.")
+    parser.add_argument("paths", nargs="+", help="audio files or directories (searched recursively)")
+    parser.add_argument("--output-dir", help="where transcripts go (default: next to each input)")
+    parser.add_argument("--format", choices=("txt", "jsonl"), default="txt")
+    parser.add_argument("--model", default=config.model_id)
+    parser.add_argument("--backend", default=config.backend)
+    parser.add_argument("--language", help="decode in this language instead of detecting it per chunk")
+    parser.add_argument("--batch-size", type=int, default=config.batch_max_size,
+                        help="chunks per pipeline call")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="processes decoding audio ahead of the model")
+    parser.add_argument("--chunk-s", type=float, default=30.0, help="longest chunk, Whisper's window")
+    parser.add_argument("--search-s", type=float, default=2.0,
+                        help="how far before a chunk limit to look for a quiet cut point")
+    parser.add_argument("--overwrite", action="store_true", help="redo files that already have a transcript")
+    args = parser.parse_args()
+    if not 0 < args.search_s < args.chunk_s:
+        parser.error("--search-s must be between 0 and --chunk-s")
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(130)
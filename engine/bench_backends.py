@@ -0,0 +1,55 @@
+import argparse
+import json
+import time
+import numpy as np
+from asr import SAMPLE_RATE, SpeechRecognizer
+from audio import load_wav
+
+# Loads each model/backend combination and measures its real-time factor (compute
+# time / audio time) on the same audio. Below 1.0 a backend keeps up with live speech.
+#   python bench_backends.py --models tiny small large-v3 --backends fp32 bf16 int8 --audio speech.wav
+
+def bench(model, backend, audio, repeat, language):
+    recognizer = SpeechRecognizer(model, backend)
+    start = time.perf_counter()
+    recognizer.load()
+    load_s = time.perf_counter() - start
+    recognizer.warm_up()
+    text = None
+    for _ in range(repeat):
+        text = recognizer.transcribe({"raw": audio.copy(), "sampling_rate": SAMPLE_RATE}, language)
+    return {"model": recognizer.model_id, "backend": recognizer.backend, "load_s": round(load_s, 2),
+            "rtf": round(recognizer.rtf(), 4), "text": text}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["tiny", "base", "small", "large-v3"])
+    parser.add_argument("--backends", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--audio", help="WAV file to transcribe (default: 10 s of synthetic noise)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.audio:
+        audio = load_wav(args.audio)
+    else:
+        # noise makes the decoder work harder than silence, but real speech is better
+        audio = (0.05 * np.random.default_rng(0).standard_normal(10 * SAMPLE_RATE)).astype(np.float32)
+
+    results = []
+    for model in args.models:
+        for backend in args.backends:
+            try:
+                result = bench(model, backend, audio, args.repeat, args.language)
+            except Exception as e:
+                result = {"model": model, "backend": backend, "error": str(e)}
+            results.append(result)
+            if "error" in result:
+                print(f"{model:>20} {backend:>5}  skipped: {result['error']}")
+            else:
+                live = "keeps up" if result["rtf"] < 1 else "too slow for live speech"
+                print(f"{model:>20} {backend:>5}  rtf {result['rtf']:.3f}  load {result['load_s']:.1f}s  {live}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
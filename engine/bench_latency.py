@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from audio import SAMPLE_RATE, load_wav
+from protocol import CONTROL, decode_control, encode_audio, encode_control, read_frames
+
+# End-to-end benchmark through the engine's real Unix-socket protocol. For each
+# configuration an engine is started as a subprocess, clients stream audio to it
+# (client source, so no PipeWire is needed) and we measure the time from "off" to
+# the final transcription.
+#   python bench_latency.py --config stub:TRANSCRIBER_MODEL_ID=stub \
+#       --config tiny-int8:TRANSCRIBER_MODEL_ID=tiny,TRANSCRIBER_BACKEND=int8 \
+#       --clients 4 --utterances 10 --output results.json
+
+ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+FRAME_SAMPLES = SAMPLE_RATE // 10
+
+def synthetic_utterance(seconds, seed=0):
+    # voiced-like bursts separated by short pauses so the VAD sees speech
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.2 * np.sin(2 * np.pi * 180 * t) * (np.sin(2 * np.pi * 0.7 * t) > -0.6)
+    return (audio + 0.002 * rng.standard_normal(len(t))).astype(np.float32)
+
+def to_pcm(audio):
+    return (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 4) if values else None
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+async def wait_ready(socket_path, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        async for kind, payload in read_frames(reader):
+            message = decode_control(payload) if kind == CONTROL else {}
+            if message.get("type") == "status" and message["state"] != "loading":
+                writer.close()
+                if message["state"] != "ready":
+                    raise RuntimeError(f"engine failed to load: {message.get('message')}")
+                return
+        writer.close()
+    raise TimeoutError("engine did not become ready")
+
+async def client(socket_path, utterances, realtime, latencies):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    frames = read_frames(reader)
+    for audio in utterances:
+        pcm = to_pcm(audio)
+        writer.write(encode_control({"type": "transcribe", "event": "on", "language": "en",
+                                     "source": "client", "sample_rate": SAMPLE_RATE}))
+        for pos in range(0, len(pcm), FRAME_SAMPLES * 2):
+            writer.write(encode_audio(pcm[pos:pos + FRAME_SAMPLES * 2], SAMPLE_RATE))
+            if realtime:
+                await writer.drain()
+                await asyncio.sleep(FRAME_SAMPLES / SAMPLE_RATE)
+        await writer.drain()
+        sent = time.perf_counter()
+        writer.write(encode_control({"type": "transcribe", "event": "off"}))
+        await writer.drain()
+        async for kind, payload in frames:
+            message = decode_control(payload) if kind == CONTROL else {}
+            if message.get("type") == "error":
+                raise RuntimeError(message.get("message"))
+            if message.get("type") == "transcription" and message.get("final"):
+                latencies.append(time.perf_counter() - sent)
+                break
+    writer.close()
+
+async def engine_status(socket_path):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(encode_control({"type": "status"}))
+    frames = read_frames(reader)
+    await anext(frames)  # the greeting sent on connect
+    kind, payload = await anext(frames)
+    writer.close()
+    return decode_control(payload)
+
+async def run_config(name, env, args, audios):
+    with tempfile.TemporaryDirectory() as workdir:
+        socket_path = os.path.join(workdir, "my_socket.sock")
+        log = open(os.path.join(workdir, "engine.log"), "w")
+        # stdin stays open: the engine's console reads from it. The clips repeat across
+        # utterances and clients, so the result cache is off unless a config turns it on
+        env = {"TRANSCRIBER_CACHE_MAX_MB": "0", **os.environ, **env}
+        engine = subprocess.Popen([sys.executable, ENGINE], cwd=workdir, env=env,
+                                  stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            await wait_ready(socket_path, args.ready_timeout)
+            latencies = []
+            start = time.perf_counter()
+            await asyncio.gather(*(client(socket_path, audios, args.realtime, latencies)
+                                   for _ in range(args.clients)))
+            wall = time.perf_counter() - start
+            status = await engine_status(socket_path)
+            audio_s = args.clients * sum(len(audio) for audio in audios) / SAMPLE_RATE
+            return {
+                "config": name,
+                "env": env,
+                "clients": args.clients,
+                "utterances": len(latencies),
+                "audio_s": round(audio_s, 2),
+                "latency_p50_s": percentile(latencies, 50),
+                "latency_p95_s": percentile(latencies, 95),
+                "latency_p99_s": percentile(latencies, 99),
+                "rtf": status.get("rtf"),
+                "throughput_utt_per_s": round(len(latencies) / wall, 3),
+                "peak_rss_mb": peak_rss_mb(engine.pid),
+                "timings": status.get("timings"),
+            }
+        finally:
+            engine.terminate()
+            engine.wait()
+            log.close()
+
+def parse_config(spec):
+    # "name:KEY=VALUE,KEY=VALUE"
+    name, _, assignments = spec.partition(":")
+    env = dict(item.split("=", 1) for item in assignments.split(",") if item)
+    return name, env
+
+async def main(args):
+    if args.audio:
+        audios = [load_wav(path) for path in args.audio]
+    else:
+        audios = [synthetic_utterance(seconds, seed) for seed, seconds in enumerate(args.durations)]
+    audios = [audios[i % len(audios)] for i in range(args.utterances)]
+    configs = [parse_config(spec) for spec in args.config] or [("stub", {"TRANSCRIBER_MODEL_ID": "stub"})]
+    results = []
+    for name, env in configs:
+        result = await run_config(name, env, args, audios)
+        results.append(result)
+        print(f"{name}: p50 {result['latency_p50_s']}s p95 {result['latency_p95_s']}s "
+              f"p99 {result['latency_p99_s']}s rtf {result['rtf']} "
+              f"{result['throughput_utt_per_s']} utt/s peak rss {result['peak_rss_mb']} MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", action="append", default=[],
+                        help="name:ENV=VALUE,... engine environment for one run (repeatable)")
+    parser.add_argument("--audio", nargs="+", help="WAV fixtures (default: synthetic utterances)")
+    parser.add_argument("--durations", nargs="+", type=float, default=[2.0, 5.0, 10.0],
+                        help="lengths of the synthetic utterances in seconds")
+    parser.add_argument("--utterances", type=int, default=10, help="utterances per client")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--realtime", action="store_true", help="pace audio like a live microphone")
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="write the results as JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+import argparse
+import random
+import time
+from protocol import AUDIO, CONTROL, FrameDecoder, ProtocolError, encode_control, encode_frame
+
+# Fuzzes the frame decoder with randomly split streams and measures how many
+# frames per second it parses.
+#   python bench_protocol.py --rounds 200 --frames 20000
+
+def random_frames(rng, count):
+    frames = []
+    for i in range(count):
+        if rng.random() < 0.5:
+            frames.append(encode_control({"type": "transcription", "text": "x" * rng.randint(0, 400), "n": i}))
+        else:
+            frames.append(encode_frame(AUDIO, rng.randbytes(rng.choice((0, 1, 320, 3200, 70000)))))
+    return frames
+
+def fuzz(rng, rounds):
+    for _ in range(rounds):
+        frames = random_frames(rng, rng.randint(1, 200))
+        stream = b"".join(frames)
+        decoder = FrameDecoder(capacity=rng.choice((16, 1024, 65536)))
+        decoded = []
+        pos = 0
+        while pos < len(stream):
+            step = rng.choice((1, 2, 5, 4096, 65536, len(stream)))
+            decoder.feed(stream[pos:pos + step])
+            pos += step
+            decoded.extend(encode_frame(kind, bytes(payload)) for kind, payload in decoder.frames())
+        assert decoded == frames, "decoded frames differ from the encoded stream"
+        assert decoder.start == decoder.end, "decoder left bytes behind"
+
+    # oversized frames are rejected instead of buffered
+    decoder = FrameDecoder(max_frame=1024)
+    decoder.feed(encode_frame(CONTROL, b"x" * 2048))
+    try:
+        list(decoder.frames())
+    except ProtocolError:
+        pass
+    else:
+        raise AssertionError("oversized frame was accepted")
+
+def throughput(rng, count, read_size):
+    stream = b"".join(encode_control({"type": "transcription", "text": "hello world", "final": True})
+                      for _ in range(count))
+    decoder = FrameDecoder()
+    start = time.perf_counter()
+    parsed = 0
+    for pos in range(0, len(stream), read_size):
+        decoder.feed(stream[pos:pos + read_size])
+        for _ in decoder.frames():
+            parsed += 1
+    elapsed = time.perf_counter() - start
+    assert parsed == count
+    return count / elapsed, len(stream) / elapsed / 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--read-size", type=int, default=65536)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fuzz(rng, args.rounds)
+    print(f"fuzz: {args.rounds} rounds ok")
+    frames_per_s, mb_per_s = throughput(rng, args.frames, args.read_size)
+    print(f"throughput: {frames_per_s:,.0f} frames/s, {mb_per_s:.1f} MB/s")
@@ -0,0 +1,62 @@
+import argparse
+import json
+import time
+import numpy as np
+from asr import SAMPLE_RATE, SpeechRecognizer
+from audio import load_wav
+from metrics import metrics
+
+# Compares plain greedy decoding with assisted (speculative) decoding on the same
+# audio: wall time, passes through the main model's decoder and whether the text
+# is identical, which it should be since the main model verifies every token.
+#   python bench_speculative.py --model large-v3 --assistant distil-large-v3 --audio speech.wav
+
+def decoder_passes():
+    # the main model's decoder is instrumented (asr.instrument), the assistant's is not
+    return metrics.stages["decoder_step"].count if "decoder_step" in metrics.stages else 0
+
+def bench(model, assistant, backend, device, audio, repeat, language):
+    recognizer = SpeechRecognizer(model, backend, device, assistant_id=assistant)
+    recognizer.load()
+    recognizer.warm_up()
+    texts, times = [], []
+    passes = decoder_passes()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        texts.append(recognizer.transcribe({"raw": audio.copy(), "sampling_rate": SAMPLE_RATE}, language))
+        times.append(time.perf_counter() - start)
+    return {"model": recognizer.model_id, "assistant": recognizer.assistant_id,
+            "backend": recognizer.backend, "seconds": round(min(times), 3),
+            "rtf": round(min(times) * SAMPLE_RATE / len(audio), 4),
+            "decoder_passes": (decoder_passes() - passes) // repeat, "text": texts[-1]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="large-v3")
+    parser.add_argument("--assistant", default="distil-large-v3",
+                        help="draft model sharing the main model's tokenizer")
+    parser.add_argument("--backend", default="fp32")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--audio", help="WAV file of speech (default: 10 s of synthetic noise)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.audio:
+        audio = load_wav(args.audio)
+    else:
+        # noise decodes to little text; drafts pay off on real speech
+        audio = (0.05 * np.random.default_rng(0).standard_normal(10 * SAMPLE_RATE)).astype(np.float32)
+
+    plain = bench(args.model, None, args.backend, args.device, audio, args.repeat, args.language)
+    assisted = bench(args.model, args.assistant, args.backend, args.device, audio, args.repeat, args.language)
+    for result in (plain, assisted):
+        name = f"{result['model']} + {result['assistant']}" if result["assistant"] else result["model"]
+        print(f"{name:>55}  {result['seconds']:.2f}s  rtf {result['rtf']:.3f}  "
+              f"{result['decoder_passes']} decoder passes")
+    print(f"speedup {plain['seconds'] / assisted['seconds']:.2f}x, "
+          f"{'identical' if plain['text'] == assisted['text'] else 'DIFFERENT'} text")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"plain": plain, "assisted": assisted}, f, indent=2)
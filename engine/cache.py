@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from metrics import metrics
+
+class ResultCache:
+    """Content-addressed cache of transcription results.
+
+    Keys hash the audio, quantized to 16-bit PCM so float noise from conversions
+    does not matter, together with everything that changes the output: model,
+    backend, language and decoding parameters. Results are kept as JSON in an
+    LRU bounded by `max_bytes`, and optionally in `directory` so they survive
+    restarts. Identical requests that are still being decoded share one decode.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # key -> JSON bytes, least recently used first
+        self.bytes = 0
+        self.inflight = {}  # key -> future of a decode in progress
+        self.executor = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # a thread of its own: the default executor can be taken up by blocking reads elsewhere
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
+        metrics.gauge("cache_bytes", lambda: self.bytes)
+        metrics.gauge("cache_entries", lambda: len(self.entries))
+
+    @staticmethod
+    def key(audio, **params):
+        pcm = np.clip(np.asarray(audio, dtype=np.float32) * 32768.0, -32768, 32767).astype("<i2")
+        digest = hashlib.blake2b(pcm.tobytes(), digest_size=20)
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    async def get_or_compute(self, key, compute):
+        # compute returns an awaitable of a JSON-serialisable result
+        data = self.entries.get(key)
+        if data is None and self.directory:
+            data = await self._run(self._read, key)
+            if data is not None:
+                self._remember(key, data)
+        if data is not None:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            metrics.count("cache_hits")
+            return json.loads(data)
+        while key in self.inflight:
+            try:
+                result = await asyncio.shield(self.inflight[key])
+            except Exception:
+                continue  # that decode failed or was cancelled: wait for the next one or decode here
+            metrics.count("cache_hits")
+            return result
+        metrics.count("cache_misses")
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await compute()
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Decode abandoned"))
+            future.exception()  # retrieved here, waiters re-raise it themselves
+            raise
+        finally:
+            del self.inflight[key]
+        future.set_result(result)
+        if result.get("degraded"):
+            return result  # a fallback model's output, not what the key promises
+        data = json.dumps(result).encode('utf-8')
+        self._remember(key, data)
+        if self.directory:
+            await self._run(self._write, key, data)
+        return result
+
+    def _remember(self, key, data):
+        if key in self.entries or len(data) > self.max_bytes:
+            return
+        self.entries[key] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            metrics.count("cache_evictions")
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a crash never leaves half a result behind
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,97 @@
+import os
+
+# engine settings, overridable with TRANSCRIBER_* environment variables
+# (pass them with `docker run -e` in run.sh)
+
+def _env(name, default, cast=str):
+    value = os.environ.get(f"TRANSCRIBER_{name}")
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+def _flag(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+# a Hugging Face model id or a short name from backends.MODELS (tiny, base, small, distil-large-v3, ...)
+model_id = _env("MODEL_ID", "openai/whisper-large-v3")
+backend = _env("BACKEND", "auto")  # auto, fp32, fp16, bf16 or int8, see backends.py
+# small model whose quick transcription is sent as "final": false the moment a recording
+# stops, before the final one from MODEL_ID (empty = off)
+draft_model = _env("DRAFT_MODEL", "")
+# draft model for assisted (speculative) decoding, sharing MODEL_ID's tokenizer, e.g.
+# distil-large-v3 for large-v3; same output, fewer passes through the big decoder (empty = off)
+assistant_model = _env("ASSISTANT_MODEL", "")
+# MODEL_ID=stub runs a fake model that sleeps STUB_RTF seconds per second of audio
+# ("stub:0.01" sets its own rate, e.g. for DRAFT_MODEL or DEGRADE_MODEL)
+stub_rtf = _env("STUB_RTF", 0.05, float)
+
+# audio capture: "arecord", "file:<path>" (WAV or raw 16 kHz S16_LE) or "-" for stdin
+capture_source = _env("CAPTURE", "arecord")
+capture_device = _env("CAPTURE_DEVICE", "pipewire")
+capture_realtime = _env("CAPTURE_REALTIME", False, _flag)  # pace file sources like a microphone
+capture_buffer_s = _env("CAPTURE_BUFFER", 300.0, float)  # ring buffer length per connection
+
+# long recordings: audio is moved from the ring to a file in SPILL_DIR (empty = the system temp
+# directory) in chunks of at most LONG_CHUNK seconds, cut at a quiet point and decoded while
+# recording, so only the last chunk is left at "off"; "long" in {"type": "transcribe",
+# "event": "on"} overrides it per recording
+long_recording = _env("LONG_RECORDING", False, _flag)
+long_chunk_s = _env("LONG_CHUNK", 30.0, float)
+spill_dir = _env("SPILL_DIR", "")
+
+# voice activity detection: "energy", "silero" (model-based, fetched via torch.hub) or "off"
+vad = _env("VAD", "energy")
+vad_threshold_db = _env("VAD_THRESHOLD_DB", -45.0, float)  # minimum speech energy in dBFS
+vad_min_silence_s = _env("VAD_MIN_SILENCE", 0.5, float)  # pause that ends a segment
+vad_speech_pad_s = _env("VAD_SPEECH_PAD", 0.2, float)  # silence kept around each segment
+vad_min_speech_s = _env("VAD_MIN_SPEECH", 0.25, float)  # shorter bursts are dropped
+vad_max_segment_s = _env("VAD_MAX_SEGMENT", 30.0, float)  # split at the quietest point past this
+
+# batching of finished utterances across sessions
+batch_max_size = _env("BATCH_MAX_SIZE", 8, int)
+batch_max_wait_s = _env("BATCH_MAX_WAIT", 0.02, float)  # how long the first utterance waits for company
+# inference worker processes sharing one copy of the weights (1 = decode in the engine process);
+# each is pinned to its share of the cores and runs WORKER_THREADS intra-op threads (0 = that share)
+workers = _env("WORKERS", 1, int)
+worker_threads = _env("WORKER_THREADS", 0, int)
+
+# bounded queue of utterances waiting for the model (0 = unbounded); when it is full
+# "reject" answers {"type": "error", "code": "busy"}, "drop_oldest" fails the longest
+# waiting utterance instead, and "degrade" rejects too but already switches to
+# DEGRADE_MODEL once DEGRADE_AT utterances wait (default: half the queue)
+queue_max_size = _env("QUEUE_MAX_SIZE", 64, int)
+queue_policy = _env("QUEUE_POLICY", "reject")
+queue_degrade_at = _env("QUEUE_DEGRADE_AT", 0, int)
+degrade_model = _env("DEGRADE_MODEL", "distil-large-v3")
+# give up on a transcription this long after it was submitted (0 = never); "deadline_s" in
+# {"type": "transcribe", "event": "on"} overrides it per recording
+job_deadline_s = _env("JOB_DEADLINE", 0.0, float)
+
+# cache of final transcriptions keyed by audio content, language, model and decoding settings
+cache_max_mb = _env("CACHE_MAX_MB", 64.0, float)  # in-memory budget, 0 = no memory tier
+cache_dir = _env("CACHE_DIR", "")  # also keep results on disk here (empty = off)
+
+# messages waiting to be written to one connection; a slow reader's partials and drafts are
+# coalesced, and when its queue is still full "drop" throws away the oldest of them (or the
+# oldest message) while "disconnect" closes the connection
+outbox_max_size = _env("OUTBOX_MAX_SIZE", 256, int)
+outbox_policy = _env("OUTBOX_POLICY", "drop")
+
+# every final transcription is kept in this SQLite database with a full-text index ("off" = none),
+# written in one transaction every STORE_FLUSH seconds; {"type": "search"} and
+# {"type": "history"} page through it
+store_path = _env("STORE", "transcripts.db")
+store_flush_s = _env("STORE_FLUSH", 1.0, float)
+
+# serve Prometheus text metrics over HTTP on this port (0 = off); always available via {"type": "stats"}
+metrics_port = _env("METRICS_PORT", 0, int)
+# {"type": "profile", "count": N} profiles the next N transcriptions into this directory
+# (only with WORKERS=1, the worker processes are not profiled)
+profile_dir = _env("PROFILE_DIR", "profiles")
+
+# streaming transcription while the key is held
+streaming = _env("STREAMING", False, _flag)
+stream_step_s = _env("STREAM_STEP", 1.0, float)  # how often a rolling window is decoded
+stream_min_new_s = _env("STREAM_MIN_NEW", 0.5, float)  # minimum fresh audio before re-decoding
+stream_trim_s = _env("STREAM_TRIM", 15.0, float)  # trim committed audio once the window is this long
+stream_max_window_s = _env("STREAM_MAX_WINDOW", 25.0, float)  # force a commit past this length
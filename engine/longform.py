@@ -0,0 +1,74 @@
+import tempfile
+import numpy as np
+from audio import SAMPLE_RATE
+from metrics import metrics
+
+class SpillFile:
+    """16-bit PCM of one recording in an unlinked temporary file, read back through a memory map."""
+
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(prefix="recording-", suffix=".pcm", dir=directory or None)
+        self.length = 0  # samples written
+
+    def append(self, samples):
+        pcm = np.clip(samples * 32768.0, -32768, 32767).astype("<i2")
+        self.file.write(pcm.tobytes())
+        self.length += len(pcm)
+
+    def read(self, start, end):
+        # only [start, end) is paged in and converted, however long the recording is
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        self.file.flush()
+        mapped = np.memmap(self.file, dtype="<i2", mode="r", offset=start * 2, shape=(end - start,))
+        return mapped * np.float32(1.0 / 32768.0)
+
+    def close(self):
+        self.file.close()
+
+class ChunkedRecording:
+    """Moves a recording out of the ring buffer in chunks of at most `chunk_s` as it is captured.
+
+    Call `process` whenever audio is written to the ring buffer. Every time
+    `chunk_s` has accumulated, the audio up to the quietest 30 ms of its last
+    `search_s` is appended to the spill file and `on_chunk(start, end)` is called
+    with its span in that file, so it can be decoded while recording goes on.
+    RAM holds only the ring, whatever the length of the recording; `finish`
+    spills the remaining partial chunk.
+    """
+
+    def __init__(self, ring, start, spill, on_chunk, chunk_s=30.0, search_s=5.0, sample_rate=SAMPLE_RATE):
+        self.ring = ring
+        self.next = start  # ring position of the first sample not spilled yet
+        self.spill = spill
+        self.on_chunk = on_chunk
+        # the chunk must still be in the ring when it is cut
+        self.chunk = min(int(chunk_s * sample_rate), ring.capacity)
+        self.search = min(int(search_s * sample_rate), self.chunk // 2)
+        self.frame = sample_rate * 30 // 1000
+
+    def process(self):
+        while self.ring.end - self.next >= self.chunk:
+            audio = self.ring.read(self.next, self.next + self.chunk)
+            lo = self.chunk - self.search
+            count = self.search // self.frame
+            frames = audio[lo:lo + count * self.frame].reshape(count, self.frame)
+            cut = lo + int(np.argmin(np.einsum("ij,ij->i", frames, frames))) * self.frame + self.frame // 2
+            self._spill(audio[:cut])
+
+    def finish(self):
+        self.process()
+        self._spill(self.ring.read(self.next))
+        return self.spill.length / SAMPLE_RATE
+
+    def _spill(self, audio):
+        if not len(audio):
+            return
+        start = self.spill.length
+        self.spill.append(audio)
+        self.next += len(audio)
+        metrics.count("spilled_seconds", len(audio) / SAMPLE_RATE)
+        self.on_chunk(start, self.spill.length)
+
+    def close(self):
+        self.spill.close()
@@ -1,117 +1,585 @@
-import torch
-import json
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+import time
 import asyncio
+import functools
 import os
-import subprocess
+import threading
+import config
+from asr import make_recognizer
+from cache import ResultCache
+from worker import InferenceWorker
+from pool import WorkerPool
+from scheduler import BatchScheduler, CancelToken, EngineBusy, JobCancelled
+from session import Session
+from outbox import Outbox
+from audio import SAMPLE_RATE, ClientRecorder, Recorder, make_source
+from streaming import StreamingTranscriber
+from concurrent.futures import ThreadPoolExecutor
+from vad import Segmenter, load_silero, make_vad
+from longform import ChunkedRecording, SpillFile
+from metrics import metrics, serve_prometheus
+from profiling import Profiler
+from store import TranscriptStore
+from protocol import AUDIO, CONTROL, ProtocolError, decode_audio, decode_control, read_frames
 
-device = "cuda:0" if torch.cuda.is_available() else "cpu"
-torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-model_id = "openai/whisper-large-v3"
-model = AutoModelForSpeechSeq2Seq.from_pretrained(
-    model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True)
-model.to(device)
+model_id = config.model_id
+process_start = time.perf_counter()
+result_cache = (ResultCache(int(config.cache_max_mb * 2**20), config.cache_dir or None)
+                if config.cache_max_mb > 0 or config.cache_dir else None)
 
-async def start_recording():
-    cmd = ["arecord", "--device=pipewire", "-f", "S16_LE", "test.wav"]
-    handle = subprocess.Popen(cmd)  # Use Popen instead of run
-    return handle
+class Engine:
+    """Shared state of a running engine: the model, its scheduler and the connected sessions.
 
-async def stop_recording(handle):
+    The socket is bound before the model exists. Until `load` finishes the engine
+    reports "loading" and the scheduler holds every submitted utterance, which
+    is decoded once the model is ready.
+    """
+
+    def __init__(self):
+        self.recognizer = make_recognizer(model_id, config.backend, config.stub_rtf, config.assistant_model)
+        self.profiler = Profiler(config.profile_dir)
+        self.worker = InferenceWorker(self.recognizer, self.profiler)
+        # several processes sharing the model's weights, fed least-loaded first
+        self.pool = (WorkerPool(self.worker, config.workers, config.batch_max_size, config.worker_threads)
+                     if config.workers > 1 else None)
+        # a small model whose quick draft is sent before the final transcription
+        self.draft = make_recognizer(config.draft_model, config.backend, config.stub_rtf) if config.draft_model else None
+        self.draft_worker = InferenceWorker(self.draft) if self.draft else None  # own thread, never queues behind batches
+        self.draft_ready = False
+        # a faster model that takes over batches while the queue is long
+        self.fallback = (make_recognizer(config.degrade_model, config.backend, config.stub_rtf)
+                         if config.queue_policy == "degrade" else None)
+        # one model serves every session; finished utterances are batched across them
+        self.scheduler = BatchScheduler(self.pool or self.worker, config.batch_max_size, config.batch_max_wait_s,
+                                        config.queue_max_size, config.queue_policy,
+                                        config.queue_degrade_at, self.fallback)
+        # the Silero VAD model is loaded once and copied for each session; it classifies on its own thread
+        self.vad_model = None
+        self.vad_executor = (ThreadPoolExecutor(max_workers=1, thread_name_prefix="vad")
+                             if config.vad == "silero" else None)
+        # final transcriptions, kept and searchable across runs
+        self.store = self.open_store()
+        self.sessions = set()
+        self.watchers = set()  # outboxes of connections subscribed to every session
+        self.state = "loading"
+        self.error = None
+        self.timings = {}
+        metrics.gauge("sessions", lambda: len(self.sessions))
+        metrics.gauge("rtf", self.recognizer.rtf)
+
+    async def load(self):
+        if self.vad_executor:
+            self.vad_task = asyncio.create_task(self.load_vad())
+        try:
+            # load and warm up on the inference thread so its thread-local state is initialised too
+            await self.worker.run(self.recognizer.load)
+            print(f"Model {self.recognizer.model_id} ({self.recognizer.backend}) loaded on "
+                  f"{self.recognizer.device} in "
+                  f"{self.recognizer.timings['load']:.2f}s "
+                  f"(imports {self.recognizer.timings['import']:.2f}s)")
+            if self.pool:
+                start = time.perf_counter()
+                # the workers warm up their own pipelines
+                await asyncio.to_thread(self.pool.start)
+                self.recognizer.timings["workers"] = time.perf_counter() - start
+                print(f"{config.workers} inference workers started in {self.recognizer.timings['workers']:.2f}s")
+            else:
+                await self.worker.run(self.recognizer.warm_up)
+                print(f"Warm-up finished in {self.recognizer.timings['warm_up']:.2f}s")
+            self.state = "ready"
+        except Exception as e:
+            print(f"Model failed to load: {e}")
+            self.state, self.error = "error", str(e)
+        self.timings.update(self.recognizer.timings)
+        self.timings["ready"] = time.perf_counter() - process_start
+        # queued requests are released now, and fail fast if the model did not load
+        self.scheduler.start()
+        await self.broadcast(self.status())
+        if self.draft and self.state == "ready":
+            try:
+                await self.draft_worker.run(self.draft.load)
+                await self.draft_worker.run(self.draft.warm_up)
+                self.draft_ready = True
+                print(f"Draft model {self.draft.model_id} ready")
+            except Exception as e:
+                print(f"Draft model failed to load, only final transcriptions are sent: {e}")
+        if self.fallback and self.state == "ready":
+            try:
+                await self.worker.run(self.fallback.load)
+                await self.worker.run(self.fallback.warm_up)
+                print(f"Fallback model {self.fallback.model_id} ready for overload")
+            except Exception as e:
+                print(f"Fallback model failed to load, overload is only rejected: {e}")
+
+    async def load_vad(self):
+        try:
+            self.vad_model = await asyncio.get_running_loop().run_in_executor(self.vad_executor, load_silero)
+            print("Silero VAD ready")
+        except Exception as e:
+            print(f"Silero VAD failed to load, using the energy VAD: {e}")
+
+    @staticmethod
+    def open_store():
+        if config.store_path in ("off", "none"):
+            return None
+        try:
+            return TranscriptStore(config.store_path, config.store_flush_s)
+        except Exception as e:
+            print(f"Transcript store {config.store_path} unavailable, transcriptions are not kept: {e}")
+            return None
+
+    def status(self):
+        rtf = self.recognizer.rtf()
+        status = {"type": "status", "state": self.state,
+                  "model": self.recognizer.model_id, "backend": self.recognizer.backend,
+                  "rtf": round(rtf, 3) if rtf is not None else None,
+                  "timings": {name: round(value, 3) for name, value in self.timings.items()}}
+        if self.recognizer.assistant_id:
+            status["assistant"] = self.recognizer.assistant_id
+        if self.error:
+            status["message"] = self.error
+        return status
+
+    def session(self, id_):
+        return next((session for session in self.sessions if session.id == int(id_)), None)
+
+    def unsubscribe(self, outbox):
+        self.watchers.discard(outbox)
+        for session in self.sessions:
+            session.subscribers.discard(outbox)
+
+    async def broadcast(self, message):
+        for session in list(self.sessions):
+            try:
+                await session.send(message)
+            except ConnectionError:
+                pass
+
+async def start_recording(ring, source=None):
+    if source == "client":
+        # the client streams audio frames over the socket, nothing to capture here
+        return await ClientRecorder(ring).start()
+    source = make_source(config.capture_source, config.capture_device, config.capture_realtime)
+    return await Recorder(source, ring).start()
+
+async def stop_recording(handle, read=True):
+    # returns the captured audio as a float32 array ready for the feature extractor
     if handle:
-        handle.terminate()
-        handle.wait()  # Wait for the process to actually terminate
-    return handle
+        with metrics.span("capture_stop"):
+            return await handle.stop(read)
+
+async def stream_transcription(session, stream, scheduler, language, token=None):
+    # decode a rolling window while the key is held and push partial results
+    while True:
+        await asyncio.sleep(config.stream_step_s)
+        if not stream.ready():
+            continue
+        if session.segmenter and not session.segmenter.has_speech(stream.decoded_end, stream.ring.end):
+            continue  # nothing but silence since the last decode
+        try:
+            result = await scheduler.submit(stream.window(), language, token, session.deadline_s)
+        except EngineBusy:
+            continue  # partials are the first thing to shed, the final decode still runs
+        stable, unstable = stream.update(result)
+        partial = {"type": "transcription", "session": session.id, "utterance": session.utterance,
+                   "text": " ".join(filter(None, (stable, unstable))),
+                   "stable": stable, "unstable": unstable, "final": False}
+        if result.get("degraded"):
+            partial["degraded"] = result["degraded"]
+        await session.publish(partial)
 
-async def receive_messages(reader, writer):  # Add writer parameter
-    recording_handle = None
+async def finish_stream(stream, stream_task, scheduler, language, token=None, deadline_s=None):
+    stream_task.cancel()
     try:
-        while True:
-            data = await reader.read(1024)
-            if not data:
-                break
-            message = data.decode('utf-8')
-            print(message)
-            
-            # Convert string representation of dict to actual dict
-            if message.startswith('{') and message.endswith('}'):
-                try:
-                    msg_dict = json.loads(message)  # More reliable than eval()
-                    # debug why this logic always uses the default language
-                    # lang = "en"
-                    if msg_dict.get('type') == 'transcribe':
-                        if msg_dict.get('event') == 'on' and not recording_handle:
-                            lang = msg_dict.get('language')
-                            recording_handle = await start_recording()
-                            print("Recording started")
-                        elif msg_dict.get('event') == 'off' and recording_handle:
-                            await stop_recording(recording_handle)
-                            recording_handle = None
-                            print("Recording stopped")
-                            # run automatic_speech_recognition on test.wav and send result
-                            result = await automatic_speech_recognition(audio_file="test.wav",
-                                                                        language=lang)
-                            response = {"type": "transcription", "text": result}
-                            writer.write(str(response).encode('utf-8'))
-                            await writer.drain()
-                except Exception as e:
-                    print(f"Error processing message: {e}")
-                    error_msg = {"type": "error", "message": str(e)}
-                    writer.write(str(error_msg).encode('utf-8'))
-                    await writer.drain()
-                    
+        await stream_task
+    except asyncio.CancelledError:
+        pass
+    # only the uncommitted tail is left in the window
+    if stream.window_seconds() > 0:
+        stream.finish(await scheduler.submit(stream.window(), language, token, deadline_s))
+    return {"text": stream.stable(), "degraded": stream.degraded}
+
+def join_results(results):
+    # one result for consecutive pieces of a recording, marked degraded if any piece was
+    text = " ".join(result["text"].strip() for result in results if result["text"].strip())
+    return {"text": text, "degraded": next((result["degraded"] for result in results
+                                            if result.get("degraded")), None)}
+
+def start_segmenter(session, engine, decode=True):
+    # speech segments are cut while recording and decoded as soon as each one ends;
+    # in streaming mode the segmenter only tells the stream which windows are silent
+    scheduler = engine.scheduler
+    vad = session.vad
+    if vad is None:
+        if config.vad == "silero" and engine.vad_model is None:
+            # Silero is still loading, or failed to: energy VAD for this recording only
+            vad = make_vad("energy", config.vad_threshold_db)
+        else:
+            vad = session.vad = make_vad(config.vad, config.vad_threshold_db, engine.vad_model)
+    if vad is None:
+        return None, []
+    segments = []
+    token, deadline_s = session.recording_token, session.deadline_s
+
+    def on_segment(start, end):
+        if not decode:
+            return
+        audio = session.ring.read(start, end)
+        segments.append((audio, asyncio.create_task(
+            automatic_speech_recognition(scheduler, audio=audio, language=session.language,
+                                         token=token, deadline_s=deadline_s))))
+
+    segmenter = Segmenter(vad, session.ring, session.recording.start_pos, on_segment,
+                          min_silence_s=config.vad_min_silence_s,
+                          speech_pad_s=config.vad_speech_pad_s,
+                          min_speech_s=config.vad_min_speech_s,
+                          max_segment_s=config.vad_max_segment_s,
+                          executor=engine.vad_executor)
+    session.recording.listeners.append(segmenter.process)
+    return segmenter, segments
+
+async def decode_chunk(scheduler, spill, start, end, previous, language, token=None, deadline_s=None):
+    # one chunk of a recording is decoded at a time, the ones behind it wait on disk, not in RAM
+    if previous is not None:
+        await asyncio.wait([previous])
+    audio = spill.read(start, end)
+    return await automatic_speech_recognition(scheduler, audio=audio, language=language,
+                                              token=token, deadline_s=deadline_s)
+
+def start_chunks(session, scheduler):
+    # long recordings leave the ring in chunks that are decoded while recording goes on
+    segments = []
+    spill = SpillFile(config.spill_dir)
+    token, deadline_s, language = session.recording_token, session.deadline_s, session.language
+
+    def on_chunk(start, end):
+        previous = segments[-1][1] if segments else None
+        segments.append((None, asyncio.create_task(
+            decode_chunk(scheduler, spill, start, end, previous, language, token, deadline_s))))
+
+    chunks = ChunkedRecording(session.ring, session.recording.start_pos, spill, on_chunk,
+                              chunk_s=config.long_chunk_s)
+    session.recording.listeners.append(chunks.process)
+    return chunks, segments
+
+async def send_draft(session, utterance, draft, audio, language, segments, started):
+    # quick text from the small model; the final transcription replaces it
+    if segments is None:
+        text = await draft.transcribe({"raw": audio, "sampling_rate": SAMPLE_RATE}, language)
+    else:
+        # segments the large model already finished are used as they are
+        texts = []
+        for segment_audio, task in segments:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                texts.append(task.result()["text"])
+            else:
+                texts.append(await draft.transcribe({"raw": segment_audio, "sampling_rate": SAMPLE_RATE},
+                                                    language))
+        text = " ".join(text.strip() for text in texts if text.strip())
+    await session.publish({"type": "transcription", "session": session.id, "utterance": utterance,
+                           "text": text, "final": False, "draft": True})
+    metrics.observe_stage("off_to_draft", time.perf_counter() - started)
+
+async def finish_recording(session, scheduler, audio, language, stream=None, stream_task=None,
+                           segments=None, skipped=None, token=None, deadline_s=None,
+                           utterance=None, draft=None, record=None, chunks=None, store=None):
+    # runs as its own task so the connection keeps reading while the model decodes
+    started = time.perf_counter()
+    draft_task = None
+    if draft is not None and audio is not None and not stream_task and (skipped is None or segments):
+        draft_task = asyncio.create_task(send_draft(
+            session, utterance, draft, audio, language, segments if skipped is not None else None, started))
+        draft_task.add_done_callback(
+            lambda task: task.cancelled() or task.exception() is None
+            or print(f"Draft transcription failed: {task.exception()}"))
+    try:
+        if stream_task:
+            result = await finish_stream(stream, stream_task, scheduler, language, token, deadline_s)
+            skipped = None
+        elif chunks is not None:
+            # the chunks were decoded while recording; only the last one can still be running
+            result = join_results(await asyncio.gather(*(task for _, task in segments)))
+        elif skipped is not None:
+            # most segments were decoded while recording; wait for the last one
+            result = join_results(await asyncio.gather(*(task for _, task in segments)))
+            print(f"VAD skipped {skipped:.2f}s of {len(audio) / SAMPLE_RATE:.2f}s "
+                  f"(session {session.id})")
+        else:
+            # run automatic_speech_recognition on the captured audio and send result
+            result = await automatic_speech_recognition(scheduler, audio=audio, language=language,
+                                                        token=token, deadline_s=deadline_s)
+        text, degraded = result["text"], result.get("degraded")
+        response = {"type": "transcription", "session": session.id, "utterance": utterance,
+                    "text": text, "final": True}
+        if degraded:
+            response["degraded"] = degraded  # (partly) decoded by the overload fallback model
+        if skipped is not None:
+            response["skipped_s"] = round(skipped, 2)
+            metrics.count("vad_skipped_seconds", skipped)
+        if store and record and text.strip():
+            # the model that actually produced the text
+            store.add(text=text.strip(), **{**record, "model": degraded or record["model"]})
+    except JobCancelled as e:
+        print(f"Transcription dropped (session {session.id}): {e}")
+        response = {"type": "error", "code": "cancelled", "session": session.id,
+                    "utterance": utterance, "message": str(e)}
+    except EngineBusy as e:
+        print(f"Engine busy, transcription shed (session {session.id}): {e}")
+        response = {"type": "error", "code": "busy", "session": session.id,
+                    "utterance": utterance, "message": str(e)}
+    except Exception as e:
+        print(f"Error transcribing recording: {e}")
+        response = {"type": "error", "utterance": utterance, "message": str(e)}
+    if chunks is not None:
+        chunks.close()
+    if draft_task:
+        draft_task.cancel()  # a draft that is not out yet would only replace better text
+    try:
+        await session.publish(response)
+        metrics.observe_stage("off_to_final", time.perf_counter() - started)
+    except ConnectionError:
+        print("Peer disconnected before the transcription was sent")
+
+async def send_profile(session, done):
+    paths = await done
+    print(f"Profiles written: {', '.join(paths)}")
+    try:
+        await session.send({"type": "profile", "state": "done", "paths": paths})
+    except ConnectionError:
+        print("Peer disconnected before the profile paths were sent")
+
+async def handle_message(session, engine, msg_dict):
+    scheduler = engine.scheduler
+    if msg_dict.get('type') == 'status':
+        await session.send(engine.status())
+    elif msg_dict.get('type') == 'stats':
+        if msg_dict.get('format') == 'prometheus':
+            await session.send({"type": "stats", "format": "prometheus", "text": metrics.prometheus()})
+        else:
+            await session.send({"type": "stats", **metrics.snapshot()})
+    elif msg_dict.get('type') == 'profile':
+        if engine.pool:
+            # the profiler wraps calls on the engine's inference thread, which the pool bypasses
+            raise RuntimeError("Profiling needs WORKERS=1, batches run in worker processes")
+        # torch.profiler needs torch; the stub model is profiled with cProfile
+        default_mode = "cprofile" if engine.recognizer.model_id == "stub" else "torch"
+        count = int(msg_dict.get('count', 1))
+        done = engine.profiler.arm(asyncio.get_running_loop(), count, msg_dict.get('mode', default_mode))
+        await session.send({"type": "profile", "state": "armed", "count": count})
+        session.track(asyncio.create_task(send_profile(session, done)))
+    elif msg_dict.get('type') == 'transcribe':
+        if msg_dict.get('event') == 'on' and not session.recording:
+            session.language = msg_dict.get('language')
+            session.recording_token = CancelToken(session.token)
+            session.utterance = next(session.utterance_ids)
+            session.started_at = time.time()
+            session.deadline_s = msg_dict.get('deadline_s', config.job_deadline_s)
+            session.recording = await start_recording(session.ring, msg_dict.get('source'))
+            print(f"Recording started (session {session.id})")
+            streaming = msg_dict.get('stream', config.streaming)
+            if msg_dict.get('long', config.long_recording) and not streaming:
+                session.chunks, session.segments = start_chunks(session, scheduler)
+            else:
+                session.segmenter, session.segments = start_segmenter(session, engine,
+                                                                      decode=not streaming)
+            if streaming:
+                session.stream = StreamingTranscriber(
+                    session.ring, session.recording.start_pos,
+                    trim_s=config.stream_trim_s,
+                    max_window_s=config.stream_max_window_s,
+                    min_new_s=config.stream_min_new_s)
+                session.stream_task = asyncio.create_task(
+                    stream_transcription(session, session.stream, scheduler, session.language,
+                                         session.recording_token))
+            await session.publish({"type": "ack", "event": "on", "session": session.id,
+                                   "utterance": session.utterance})
+        elif msg_dict.get('event') == 'off' and session.recording:
+            audio = await stop_recording(session.recording, read=not session.chunks)
+            session.recording = None
+            print(f"Recording stopped (session {session.id})")
+            # close the last segment or chunk before the ring can be reused by the next recording
+            if session.segmenter:
+                await session.segmenter.flush()
+            skipped = session.segmenter.finish() if session.segmenter else None
+            if session.chunks:
+                print(f"Long recording of {session.chunks.finish():.2f}s, "
+                      f"{len(session.segments)} chunks (session {session.id})")
+            session.track(asyncio.create_task(
+                finish_recording(session, scheduler, audio, session.language,
+                                 session.stream, session.stream_task,
+                                 session.segments, skipped,
+                                 session.recording_token, session.deadline_s,
+                                 session.utterance, engine.draft_worker if engine.draft_ready else None,
+                                 {"session": session.id, "utterance": session.utterance,
+                                  "started": session.started_at, "ended": time.time(),
+                                  "language": session.language, "model": model_id},
+                                 session.chunks, engine.store)))
+            session.stream = session.stream_task = None
+            session.segmenter, session.segments, session.chunks = None, [], None
+            await session.publish({"type": "ack", "event": "off", "session": session.id,
+                                   "utterance": session.utterance})
+        elif msg_dict.get('event') == 'cancel':
+            # abandon the current or latest recording: stop capturing, drop its queued
+            # jobs and stop the decoder if it is working on them
+            if session.recording_token:
+                session.recording_token.cancel()
+            if session.recording:
+                await stop_recording(session.recording)
+                session.recording = None
+                if session.stream_task:
+                    session.stream_task.cancel()
+                for _, task in session.segments:
+                    task.cancel()
+                if session.segmenter:
+                    session.segmenter.close()
+                if session.chunks:
+                    session.chunks.close()
+                session.stream = session.stream_task = None
+                session.segmenter, session.segments, session.chunks = None, [], None
+            await session.publish({"type": "ack", "event": "cancel", "session": session.id})
+    elif msg_dict.get('type') == 'subscribe':
+        # follow the events of another session, or of every session with "all"
+        target = msg_dict.get('session', 'all')
+        if target == 'all':
+            engine.watchers.add(session.outbox)
+        else:
+            other = engine.session(target)
+            if other is None:
+                raise ValueError(f"No session {target}")
+            other.subscribers.add(session.outbox)
+        await session.send({"type": "ack", "event": "subscribe", "session": target})
+    elif msg_dict.get('type') in ('search', 'history'):
+        if engine.store is None:
+            raise RuntimeError("The transcript store is off, see TRANSCRIBER_STORE")
+        limit, before = msg_dict.get('limit', 50), msg_dict.get('before')
+        if msg_dict['type'] == 'search':
+            results, next_ = await engine.store.search(msg_dict.get('query', ''), limit, before,
+                                                       msg_dict.get('raw', False))
+            reply = {"type": "search", "query": msg_dict.get('query', '')}
+        else:
+            # the requesting session by default; "run" picks a session of an earlier engine run
+            history_session = msg_dict.get('session', session.id)
+            results, next_ = await engine.store.history(history_session, msg_dict.get('run'),
+                                                        limit, before)
+            reply = {"type": "history", "session": history_session}
+        await session.send({**reply, "results": results, "next": next_})
+    elif msg_dict.get('type') == 'unsubscribe':
+        engine.unsubscribe(session.outbox)
+        await session.send({"type": "ack", "event": "unsubscribe"})
+
+async def receive_messages(reader, session, engine):
+    try:
+        async for kind, payload in read_frames(reader):
+            try:
+                if kind == AUDIO:
+                    sample_rate, pcm = decode_audio(payload)
+                    # frames that arrive after "off" are dropped
+                    if isinstance(session.recording, ClientRecorder):
+                        session.recording.feed(sample_rate, pcm)
+                    continue
+                if kind != CONTROL:
+                    raise ProtocolError(f"Unexpected frame kind {kind}")
+                msg_dict = decode_control(payload)
+                print(msg_dict)
+                await handle_message(session, engine, msg_dict)
+            except Exception as e:
+                print(f"Error processing message: {e}")
+                error_msg = {"type": "error", "message": str(e)}
+                await session.send(error_msg)
+
+    except ProtocolError as e:
+        print(f"Closing session {session.id}: {e}")
     except ConnectionError:
         print("Peer disconnected")
     finally:
+        # nobody is left to read the results: stop queued and running jobs
+        session.token.cancel()
+        for task in session.pending:
+            task.cancel()
         # Ensure recording is stopped if connection is lost
-        if recording_handle:
-            await stop_recording(recording_handle)
+        if session.stream_task:
+            session.stream_task.cancel()
+        for _, task in session.segments:
+            task.cancel()
+        if session.segmenter:
+            session.segmenter.close()
+        if session.chunks:
+            session.chunks.close()
+        if session.recording:
+            await stop_recording(session.recording, read=False)
 
-async def send_messages(writer):
-    try:
+def start_console(engine, loop):
+    # one reader of stdin for the whole engine; every line typed goes to all connected sessions.
+    # A daemon thread rather than an executor, so a pending input() never holds up shutdown
+    def read():
         while True:
-            message = await asyncio.get_event_loop().run_in_executor(
-                None, lambda: input("> ")
-            )
-            writer.write(message.encode('utf-8'))
-            await writer.drain()
-    except ConnectionError:
-        print("\nConnection lost")
-
-# refactor to use real parameters or kwargs not globals
-async def automatic_speech_recognition(audio_file, language):
-    processor = AutoProcessor.from_pretrained(model_id)
-    pipe = pipeline(
-        "automatic-speech-recognition",
-        model=model,
-        tokenizer=processor.tokenizer,
-        feature_extractor=processor.feature_extractor,
-        torch_dtype=torch_dtype,
-        chunk_length_s=30,
-        device=device,
-        return_timestamps=True,
-    )
+            try:
+                message = input("> ")
+                asyncio.run_coroutine_threadsafe(
+                    engine.broadcast({"type": "message", "text": message}), loop)
+            except (EOFError, RuntimeError):
+                return  # stdin closed, or the loop is gone
+
+    threading.Thread(target=read, name="console", daemon=True).start()
+
+async def automatic_speech_recognition(scheduler, audio, language, token=None, deadline_s=None):
     print("Output language: ", language)
-    result = pipe(audio_file, generate_kwargs={"language": language })
-    return result["text"]
 
-async def handle_connection(reader, writer):
-    receive_task = asyncio.create_task(receive_messages(reader, writer))
-    send_task = asyncio.create_task(send_messages(writer))
-    await asyncio.gather(receive_task, send_task)
+    def decode():
+        # raw float32 samples go straight to the feature extractor, no ffmpeg decode
+        return scheduler.submit({"raw": audio, "sampling_rate": SAMPLE_RATE}, language, token, deadline_s)
+
+    if result_cache is None:
+        result = await decode()
+    else:
+        key = ResultCache.key(audio, model=model_id, backend=config.backend, language=language,
+                              task="transcribe", chunk_length_s=30, return_timestamps=True)
+        result = await result_cache.get_or_compute(key, decode)
+    return result
+
+async def handle_connection(reader, writer, engine):
+    # everything for this client goes through its outbox, written by a task of its own
+    outbox = Outbox(writer, config.outbox_max_size, config.outbox_policy).start()
+    session = Session(outbox, config.capture_buffer_s, engine.watchers)
+    engine.sessions.add(session)
+    try:
+        # tell the client straight away whether the model is still loading
+        await session.send(engine.status())
+        await receive_messages(reader, session, engine)
+    finally:
+        engine.sessions.discard(session)
+        engine.unsubscribe(outbox)
+        await session.publish({"type": "session", "event": "closed", "session": session.id}, own=False)
+        outbox.close()
 
 async def main():
     socket_path = f'{os.getcwd()}/my_socket.sock'
     if os.path.exists(socket_path):
         os.remove(socket_path)
 
+    # bind first so clients can connect while the model loads in the background
+    engine = Engine()
     server = await asyncio.start_unix_server(
-        handle_connection, socket_path
+        functools.partial(handle_connection, engine=engine), socket_path
     )
-    print("Server started, waiting for connection...")
-    
-    async with server:
-        await server.serve_forever()
+    engine.timings["bind"] = time.perf_counter() - process_start
+    print(f"Server started in {engine.timings['bind']:.2f}s, loading model...")
+    load_task = asyncio.create_task(engine.load())
+    start_console(engine, asyncio.get_running_loop())
+    if config.metrics_port:
+        await serve_prometheus(config.metrics_port)
+        print(f"Prometheus metrics on http://127.0.0.1:{config.metrics_port}/metrics")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        load_task.cancel()
+        await engine.scheduler.stop()
+        (engine.pool or engine.worker).shutdown()
+        if engine.vad_executor:
+            engine.vad_executor.shutdown(wait=False, cancel_futures=True)
+        if engine.store:
+            await engine.store.close()
 
 if __name__ == "__main__":
     try:
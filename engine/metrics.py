@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Lightweight in-process metrics, cheap enough to leave on: a span costs two
+# perf_counter calls and an append. Stage timings go into rolling histograms,
+# plus counters and gauges; `snapshot` feeds the {"type": "stats"} reply and
+# `prometheus` renders the Prometheus text format.
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Cumulative buckets for Prometheus plus a window of recent values for quantiles."""
+
+    def __init__(self, window=1024):
+        self.recent = deque(maxlen=window)
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.recent.append(value)
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def summary(self):
+        values = sorted(self.recent)
+        if not values:
+            return {"count": 0}
+
+        def pick(q):
+            return round(values[min(len(values) - 1, int(q * len(values)))], 6)
+
+        return {"count": self.count, "mean": round(self.sum / self.count, 6),
+                "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1], 6)}
+
+class Span:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}  # stage name -> Histogram of seconds
+        self.values = {}  # name -> Histogram of other observations (batch size, ...)
+        self.counters = {}
+        self.gauges = {}  # name -> callable returning the current value
+
+    def _histogram(self, table, name):
+        histogram = table.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = table.setdefault(name, Histogram())
+        return histogram
+
+    def span(self, stage):
+        return Span(self._histogram(self.stages, stage))
+
+    def observe_stage(self, stage, seconds):
+        self._histogram(self.stages, stage).observe(seconds)
+
+    def observe(self, name, value):
+        self._histogram(self.values, name).observe(value)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def _gauge_values(self):
+        values = {}
+        for name, fn in self.gauges.items():
+            value = fn()
+            if value is not None:
+                values[name] = value
+        return values
+
+    def snapshot(self):
+        return {
+            "stages": {name: histogram.summary() for name, histogram in sorted(self.stages.items())},
+            "values": {name: histogram.summary() for name, histogram in sorted(self.values.items())},
+            "counters": {name: round(value, 6) for name, value in sorted(self.counters.items())},
+            "gauges": self._gauge_values(),
+        }
+
+    def prometheus(self, prefix="transcriber"):
+        lines = []
+
+        def histogram_lines(metric, label, histogram):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), histogram.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{{label + "," if label else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{label}}}" if label else ""
+            lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+            lines.append(f"{metric}_count{suffix} {histogram.count}")
+
+        lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+        for name, histogram in sorted(self.stages.items()):
+            histogram_lines(f"{prefix}_stage_seconds", f'stage="{name}"', histogram)
+        for name, histogram in sorted(self.values.items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            histogram_lines(f"{prefix}_{name}", "", histogram)
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def serve_prometheus(port, host="127.0.0.1"):
+    # minimal HTTP endpoint answering every request with the Prometheus text
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = metrics.prometheus().encode('utf-8')
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+        except (ConnectionError, OSError, EOFError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+from metrics import metrics
+from protocol import encode_control
+
+POLICIES = ("drop", "disconnect")
+
+def coalesce_key(message):
+    # messages a newer one makes worthless while they still wait: partial and draft
+    # transcriptions of an utterance (the final replaces them too) and engine status
+    if message.get("type") == "transcription":
+        return ("transcription", message.get("session"), message.get("utterance"))
+    if message.get("type") == "status":
+        return ("status",)
+    return None
+
+class Outbox:
+    """Bounded queue of control messages for one connection, written by its own task.
+
+    Putting never waits, so a client that reads slowly delays nothing but its own
+    messages. A queued partial, draft or status is replaced in place by a newer
+    one with the same coalesce key. When the queue is still full, "drop" throws
+    away the oldest replaceable message, or the oldest message if there is none,
+    and "disconnect" closes the connection of a client that fell this far behind.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, writer, max_size, policy="drop"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbox policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.writer = writer
+        self.max_size = max(1, max_size)
+        self.policy = policy
+        self.queue = OrderedDict()  # id -> message, oldest first
+        self.keys = {}  # coalesce key -> id of the queued message
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    def put(self, message):
+        if self.closed:
+            raise ConnectionResetError("Connection closed")
+        key = coalesce_key(message)
+        queued = self.keys.get(key) if key is not None else None
+        if queued is not None and not self.queue[queued].get("final"):
+            self.queue[queued] = message
+            metrics.count("outbox_coalesced")
+            return
+        if len(self.queue) >= self.max_size:
+            if self.policy == "disconnect":
+                metrics.count("outbox_disconnects")
+                print(f"Closing a connection {self.max_size} messages behind")
+                self.close()
+                raise ConnectionResetError("Client too slow")
+            self._drop()
+        id_ = next(Outbox.ids)
+        self.queue[id_] = message
+        if key is not None:
+            self.keys[key] = id_
+        self.ready.set()
+
+    def _drop(self):
+        victim = next((id_ for id_, message in self.queue.items()
+                       if coalesce_key(message) is not None and not message.get("final")),
+                      next(iter(self.queue)))
+        self._forget(victim, self.queue.pop(victim))
+        metrics.count("outbox_dropped")
+
+    def _forget(self, id_, message):
+        key = coalesce_key(message)
+        if key is not None and self.keys.get(key) == id_:
+            del self.keys[key]
+
+    async def _run(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                id_, message = self.queue.popitem(last=False)
+                self._forget(id_, message)
+                with metrics.span("socket_write"):
+                    self.writer.write(encode_control(message))
+                    await self.writer.drain()
+        except ConnectionError:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.keys.clear()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.writer.close()
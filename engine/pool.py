@@ -0,0 +1,208 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asr import audio_seconds, make_recognizer
+from backends import share_model
+from metrics import metrics
+
+class WorkerDied(RuntimeError):
+    pass
+
+class FlagToken:
+    """Stands in for a CancelToken inside a worker process; the parent sets the flag."""
+
+    def __init__(self, flags, index):
+        self.flags = flags
+        self.index = index
+
+    def expired(self):
+        return self.flags[self.index] != 0
+
+def _serve(conn, flags, spec, device, shared, shared_assistant, threads, cores):
+    # entry point of a worker process: build the recognizer around the shared weights,
+    # then transcribe batches sent over the pipe until told to stop
+    if cores:
+        os.sched_setaffinity(0, cores)
+    if threads and shared is not None:
+        import torch
+        torch.set_num_threads(threads)
+    recognizer = make_recognizer(*spec)
+    recognizer.device = device  # where the shared weights live
+    recognizer.load(shared, shared_assistant)
+    recognizer.warm_up()
+    conn.send(("ready", recognizer.timings, 0.0))
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        audios, language, count = job
+        tokens = [FlagToken(flags, index) for index in range(count)] if count else None
+        start = time.perf_counter()
+        try:
+            results = recognizer.transcribe_batch(audios, language, tokens)
+        except Exception as e:
+            conn.send(("error", str(e), time.perf_counter() - start))
+        else:
+            conn.send(("ok", results, time.perf_counter() - start))
+
+class ProcessWorker:
+    """One worker process and the parent thread that feeds it and watches its tokens."""
+
+    def __init__(self, ctx, index, spec, device, shared, shared_assistant, max_batch_size, threads, cores):
+        self.args = (ctx, index, spec, device, shared, shared_assistant, max_batch_size, threads, cores)
+        self.index = index
+        self.conn, child = ctx.Pipe()
+        self.flags = ctx.Array("b", max(1, max_batch_size), lock=False)
+        self.process = ctx.Process(target=_serve, name=f"inference-{index}", daemon=True,
+                                   args=(child, self.flags, spec, device, shared, shared_assistant,
+                                         threads, cores))
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{index}")
+        self.load = 0.0  # seconds of audio in flight
+        self.cores = cores
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def wait_ready(self):
+        status, timings, _ = self._receive()
+        return timings
+
+    def call(self, audios, language, tokens):
+        # runs on this worker's parent thread
+        for index in range(len(self.flags)):
+            self.flags[index] = 0
+        try:
+            self.conn.send((audios, language, len(tokens) if tokens else 0))
+            status, payload, compute_s = self._receive(tokens)
+        except (EOFError, OSError) as e:  # the process went away, e.g. killed by the OOM killer
+            raise WorkerDied(f"Inference worker {self.index} died: {e or type(e).__name__}") from e
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload, compute_s
+
+    def _receive(self, tokens=None):
+        while not self.conn.poll(0.02):
+            if not self.process.is_alive():
+                raise WorkerDied(f"Inference worker {self.index} exited with code {self.process.exitcode}")
+            for index, token in enumerate(tokens or ()):
+                if token is not None and token.expired():
+                    self.flags[index] = 1
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.executor.shutdown(wait=False, cancel_futures=True)  # from its own thread when replaced
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+class WorkerPool:
+    """Runs batches on N worker processes that share one copy of the model weights.
+
+    The weights loaded by the engine's recognizer are moved to shared memory and
+    handed to spawned workers, which wrap them in their own pipeline, so memory
+    stays near one model while pre/post-processing runs outside the GIL of any
+    other worker. Each worker is pinned to its own slice of the cores with as
+    many intra-op threads. Batches go to the worker with the least audio in
+    flight. Other recognizers (the overload fallback) still run in-process on
+    `local`, the engine's InferenceWorker.
+    """
+
+    def __init__(self, local, count, max_batch_size, threads=0):
+        self.local = local
+        self.recognizer = local.recognizer
+        self.count = count
+        self.max_batch_size = max_batch_size
+        self.threads = threads
+        self.workers = []
+        self.capacity = count  # batches the scheduler may have in flight at once
+
+    def start(self):
+        # blocking: spawns the workers and waits until every one has warmed up
+        recognizer = self.recognizer
+        shared = shared_assistant = None
+        if recognizer.model is not None:
+            import torch.multiprocessing as multiprocessing
+            shared = share_model(recognizer.model, recognizer.backend)
+            if recognizer.assistant is not None:
+                shared_assistant = share_model(recognizer.assistant, recognizer.backend)
+        else:
+            import multiprocessing  # the stub has no weights to share
+        ctx = multiprocessing.get_context("spawn")
+        cores = sorted(os.sched_getaffinity(0))
+        per_worker = len(cores) // self.count
+        spec = (recognizer.model_id if recognizer.model is not None else f"stub:{recognizer.stub_rtf}",
+                recognizer.backend, 0.05, recognizer.assistant_id)
+        for index in range(self.count):
+            slice_ = cores[index * per_worker:(index + 1) * per_worker] if per_worker else None
+            self.workers.append(ProcessWorker(ctx, index, spec, recognizer.device, shared, shared_assistant,
+                                              self.max_batch_size, self.threads or per_worker, slice_).start())
+        for worker in self.workers:
+            timings = worker.wait_ready()
+            print(f"Inference worker {worker.index} ready in {timings.get('load', 0.0):.2f}s"
+                  + (f" on cores {worker.cores[0]}-{worker.cores[-1]}" if worker.cores else ""))
+        return self
+
+    def run(self, fn, *args, **kwargs):
+        return self.local.run(fn, *args, **kwargs)
+
+    def transcribe_batch(self, audios, language=None, tokens=None, recognizer=None):
+        if (recognizer is not None and recognizer is not self.recognizer) or not self.workers:
+            # while every worker is being replaced the engine's own copy of the model decodes
+            return self.local.transcribe_batch(audios, language, tokens, recognizer)
+        worker = min(self.workers, key=lambda worker: worker.load)
+        seconds = sum(audio_seconds(audio) for audio in audios)
+        worker.load += seconds
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(worker.executor, functools.partial(worker.call, audios, language, tokens))
+        return asyncio.ensure_future(self._finish(future, worker, seconds, audios, language, tokens))
+
+    async def _finish(self, future, worker, seconds, audios, language, tokens):
+        try:
+            results, compute_s = await future
+        except WorkerDied as e:
+            # take it out of rotation, start a replacement and fail the batch over
+            print(f"{e}, restarting it")
+            self._replace(worker)
+            return await self.transcribe_batch(audios, language, tokens)
+        finally:
+            worker.load -= seconds
+        self.recognizer._account(seconds, compute_s)
+        return results
+
+    def _replace(self, worker):
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        metrics.count("worker_restarts")
+        loop = asyncio.get_running_loop()
+        # the dead worker's own thread is idle now: it spawns the replacement around the same weights
+        future = loop.run_in_executor(worker.executor, self._respawn, worker)
+        future.add_done_callback(functools.partial(self._replaced, worker))
+
+    def _respawn(self, worker):
+        worker.stop()
+        replacement = ProcessWorker(*worker.args).start()
+        replacement.wait_ready()
+        return replacement
+
+    def _replaced(self, worker, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            # run with one worker less; the scheduler may queue a batch behind another
+            print(f"Inference worker {worker.index} could not be restarted: {future.exception()}")
+            return
+        self.workers.append(future.result())
+        print(f"Inference worker {worker.index} restarted")
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        self.local.shutdown()
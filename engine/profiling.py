@@ -0,0 +1,77 @@
+import contextlib
+import cProfile
+import os
+import threading
+import time
+
+class Profiler:
+    """Profiles the next N transcriptions of a running engine on request.
+
+    `arm` is called on the event loop and returns a future; `capture` wraps each
+    model call on the inference thread. Profiles are written to `directory` as
+    Chrome traces (torch.profiler, CPU activities) or pstats files (cProfile),
+    and the future resolves with their paths once N transcriptions were covered.
+    """
+
+    modes = ("torch", "cprofile")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.mode = None
+        self.paths = []
+        self.future = None
+        self.loop = None
+
+    def arm(self, loop, count, mode="torch"):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown profiler {mode}, expected one of {', '.join(self.modes)}")
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        if mode == "torch":
+            import torch.profiler  # fail here rather than in the middle of a transcription
+        with self.lock:
+            if self.remaining:
+                raise RuntimeError(f"Already profiling, {self.remaining} transcriptions to go")
+            os.makedirs(self.directory, exist_ok=True)
+            self.remaining, self.mode, self.paths = count, mode, []
+            self.loop = loop
+            self.future = loop.create_future()
+            return self.future
+
+    @contextlib.contextmanager
+    def capture(self, utterances=1):
+        with self.lock:
+            active = self.remaining > 0
+            mode = self.mode
+        if not active:
+            yield
+            return
+        name = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S") + f"-{time.perf_counter_ns() % 10**6:06d}")
+        if mode == "torch":
+            from torch.profiler import ProfilerActivity, profile
+            with profile(activities=[ProfilerActivity.CPU]) as prof:
+                yield
+            path = name + ".trace.json"
+            prof.export_chrome_trace(path)
+        else:
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+            path = name + ".pstats"
+            prof.dump_stats(path)
+        self._record(path, utterances)
+
+    def _record(self, path, utterances):
+        with self.lock:
+            self.paths.append(path)
+            self.remaining = max(0, self.remaining - utterances)
+            if self.remaining:
+                return
+            future, paths = self.future, list(self.paths)
+            self.future = None
+        self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(paths))
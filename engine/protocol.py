@@ -0,0 +1,103 @@
+import json
+import struct
+
+# Wire format shared by the engine and the TUI. Every frame is a 5 byte header
+# (kind, payload length as a big-endian uint32) followed by the payload:
+#   CONTROL  UTF-8 JSON object
+#   AUDIO    uint32 big-endian sample rate, then mono S16_LE PCM
+
+CONTROL = 1
+AUDIO = 2
+
+HEADER = struct.Struct("!BI")
+AUDIO_HEADER = struct.Struct("!I")
+MAX_FRAME = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(kind, payload):
+    return HEADER.pack(kind, len(payload)) + payload
+
+def encode_control(message):
+    return encode_frame(CONTROL, json.dumps(message).encode('utf-8'))
+
+def decode_control(payload):
+    message = json.loads(bytes(payload))
+    if not isinstance(message, dict):
+        raise ProtocolError("Control frames must carry a JSON object")
+    return message
+
+def encode_audio(pcm, sample_rate):
+    return HEADER.pack(AUDIO, AUDIO_HEADER.size + len(pcm)) + AUDIO_HEADER.pack(sample_rate) + pcm
+
+def decode_audio(payload):
+    # returns the sample rate and a view of the PCM bytes, no copy
+    if len(payload) < AUDIO_HEADER.size:
+        raise ProtocolError("Audio frame is missing its sample rate")
+    (sample_rate,) = AUDIO_HEADER.unpack_from(payload)
+    if sample_rate == 0:
+        raise ProtocolError("Audio frame has a sample rate of 0")
+    if (len(payload) - AUDIO_HEADER.size) % 2:
+        raise ProtocolError("Audio frame holds a partial sample")
+    return sample_rate, payload[AUDIO_HEADER.size:]
+
+class FrameDecoder:
+    """Incremental frame parser over a persistent, preallocated buffer.
+
+    `feed` appends received bytes and `frames` yields (kind, payload) pairs where
+    payload is a memoryview into the buffer. It is only valid until the next
+    `feed`, so copy or decode it straight away. In steady state nothing is
+    allocated per frame besides the view itself.
+    """
+
+    def __init__(self, capacity=READ_SIZE * 2, max_frame=MAX_FRAME):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unconsumed byte
+        self.end = 0  # one past the last received byte
+        self.max_frame = max_frame
+
+    def feed(self, data):
+        n = len(data)
+        if self.end + n > len(self.buffer):
+            pending = self.end - self.start
+            if pending + n > len(self.buffer):
+                # grow into a fresh buffer; views handed out earlier keep the old one alive
+                capacity = len(self.buffer)
+                while capacity < pending + n:
+                    capacity *= 2
+                buffer = bytearray(capacity)
+                buffer[:pending] = self.view[self.start:self.end]
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            else:
+                # move the partial frame to the front
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        self.view[self.end:self.end + n] = data
+        self.end += n
+
+    def frames(self):
+        while self.end - self.start >= HEADER.size:
+            kind, length = HEADER.unpack_from(self.buffer, self.start)
+            if length > self.max_frame:
+                raise ProtocolError(f"Frame of {length} bytes exceeds the {self.max_frame} byte limit")
+            body = self.start + HEADER.size
+            if self.end - body < length:
+                return
+            self.start = body + length
+            yield kind, self.view[body:self.start]
+        if self.start == self.end:
+            self.start = self.end = 0
+
+async def read_frames(reader, decoder=None):
+    decoder = decoder or FrameDecoder()
+    while True:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            return
+        decoder.feed(data)
+        for frame in decoder.frames():
+            yield frame
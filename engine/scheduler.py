@@ -0,0 +1,171 @@
+import asyncio
+import time
+from metrics import metrics
+
+class JobCancelled(Exception):
+    pass
+
+class EngineBusy(Exception):
+    pass
+
+POLICIES = ("reject", "drop_oldest", "degrade")
+
+class CancelToken:
+    """Cancellation flag with an optional deadline, checked by the inference thread.
+
+    Tokens nest: a job's token expires with its recording's, which expires with
+    its connection's, so one `cancel` stops everything below it.
+    """
+
+    def __init__(self, parent=None, deadline_s=None):
+        self.parent = parent
+        self.cancelled = False
+        self.deadline = time.monotonic() + deadline_s if deadline_s else None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def expired(self):
+        if self.cancelled or (self.deadline is not None and time.monotonic() > self.deadline):
+            return True
+        return self.parent is not None and self.parent.expired()
+
+    def reason(self):
+        token = self
+        while token is not None:
+            if token.cancelled:
+                return "cancelled"
+            token = token.parent
+        return "deadline exceeded"
+
+class BatchScheduler:
+    """Groups utterances from all sessions into batched pipeline calls.
+
+    A batch is dispatched once it holds `max_batch_size` utterances or the oldest
+    one has waited `max_wait_s`. While the model is busy new utterances keep
+    queueing, so batches grow with load. Utterances are grouped by language since
+    the decoder prompt is shared across a batch. Jobs whose token expired are
+    dropped before dispatch, and stop the decoder mid-batch otherwise.
+
+    At most `max_queue` utterances wait (0 = no limit). Past that, `policy`
+    "reject" fails new ones and "drop_oldest" fails the longest waiting one,
+    both with EngineBusy. "degrade" rejects too, but already hands batches to
+    the faster `fallback` recognizer while `degrade_at` or more utterances wait.
+    """
+
+    def __init__(self, worker, max_batch_size=8, max_wait_s=0.02, max_queue=0, policy="reject",
+                 degrade_at=None, fallback=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {', '.join(POLICIES)}")
+        self.worker = worker
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self.queue = asyncio.Queue(max_queue)
+        self.policy = policy
+        self.degrade_at = degrade_at or max_queue // 2 or None
+        self.fallback = fallback
+        self.task = None
+        self.dispatches = set()
+        metrics.gauge("queue_depth", self.queue.qsize)
+
+    def start(self):
+        # a worker pool takes several batches at once, a single worker one at a time
+        self.slots = asyncio.Semaphore(getattr(self.worker, "capacity", 1))
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def submit(self, audio, language=None, token=None, deadline_s=None):
+        # resolves with the pipeline result dict ("text" and timestamped "chunks"),
+        # or raises JobCancelled once token is cancelled or deadline_s has passed
+        future = asyncio.get_running_loop().create_future()
+        token = CancelToken(token, deadline_s)
+        if self.queue.full():
+            if self.policy != "drop_oldest":
+                metrics.count("jobs_rejected")
+                future.set_exception(EngineBusy(f"{self.queue.qsize()} utterances already waiting"))
+                return future
+            _, _, _, oldest, _ = self.queue.get_nowait()
+            metrics.count("jobs_dropped")
+            if not oldest.done():
+                oldest.set_exception(EngineBusy("Dropped from a full queue for newer audio"))
+        self.queue.put_nowait((audio, language, token, future, time.perf_counter()))
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._dispatch(batch))
+            self.dispatches.add(task)
+            task.add_done_callback(self._dispatched)
+
+    def _dispatched(self, task):
+        self.dispatches.discard(task)
+        self.slots.release()
+
+    async def _dispatch(self, batch):
+        groups = {}
+        now = time.perf_counter()
+        for audio, language, token, future, submitted in batch:
+            metrics.observe_stage("queue_wait", now - submitted)
+            if future.done():  # the requester may have given up already
+                continue
+            if token.expired():
+                self._cancel(token, future)
+                continue
+            groups.setdefault(language, []).append((audio, token, future))
+        for language, items in groups.items():
+            items = [item for item in items if not item[2].done()]
+            if not items:
+                continue
+            audios = [audio for audio, _, _ in items]
+            metrics.observe("batch_size", len(audios))
+            metrics.count("utterances", len(audios))
+            recognizer = None
+            if self._degraded():
+                recognizer = self.fallback
+                metrics.count("utterances_degraded", len(audios))
+            try:
+                results = await self.worker.transcribe_batch(audios, language,
+                                                             [token for _, token, _ in items], recognizer)
+            except Exception as e:
+                for _, token, future in items:
+                    if token.expired():
+                        self._cancel(token, future)
+                    elif not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, token, future), result in zip(items, results):
+                if token.expired():
+                    self._cancel(token, future)  # decoding was cut short, the text is partial
+                elif not future.done():
+                    if recognizer is not None:
+                        result["degraded"] = recognizer.model_id
+                    future.set_result(result)
+
+    def _degraded(self):
+        return (self.policy == "degrade" and self.fallback is not None and self.fallback.pipe is not None
+                and self.degrade_at is not None and self.queue.qsize() >= self.degrade_at)
+
+    def _cancel(self, token, future):
+        metrics.count("jobs_cancelled")
+        if not future.done():
+            future.set_exception(JobCancelled(token.reason()))
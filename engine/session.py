@@ -0,0 +1,51 @@
+import itertools
+from audio import SAMPLE_RATE, RingBuffer
+from scheduler import CancelToken
+
+class Session:
+    """State for one client connection: its own capture buffer, recording and jobs."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, outbox, capture_buffer_s, watchers=None):
+        self.id = next(Session.ids)
+        self.outbox = outbox  # this connection's own messages
+        self.subscribers = set()  # outboxes of other connections following this session
+        self.watchers = watchers if watchers is not None else set()  # outboxes following every session
+        # one capture buffer per session, reused for every recording
+        self.ring = RingBuffer(int(capture_buffer_s * SAMPLE_RATE))
+        self.recording = None
+        self.language = None
+        self.stream = None
+        self.stream_task = None
+        self.vad = None  # created on the first recording, then reused
+        self.segmenter = None  # VAD segmentation of the current recording
+        self.segments = []  # (audio, transcription task) of the segments cut so far, in order
+        self.chunks = None  # ChunkedRecording of a long recording, spilling to disk
+        self.utterance_ids = itertools.count(1)
+        self.utterance = None  # id of the current or latest recording, repeated in its transcriptions
+        self.pending = set()  # transcriptions still decoding for this session
+        self.token = CancelToken()  # cancelled when the connection goes away
+        self.recording_token = None  # jobs of the latest recording, child of token
+        self.deadline_s = None
+        self.started_at = None  # wall-clock time the current recording started
+
+    def track(self, task):
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def send(self, message):
+        # queued for the connection's writer task, so a slow reader never holds up the caller
+        self.outbox.put(message)
+
+    async def publish(self, message, own=True):
+        # events of this session also go to every subscriber; one that has gone away is dropped
+        for outbox in (self.subscribers | self.watchers) - {self.outbox}:
+            try:
+                outbox.put(message)
+            except ConnectionError:
+                self.subscribers.discard(outbox)
+                self.watchers.discard(outbox)
+        if own:
+            await self.send(message)
@@ -0,0 +1,132 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL,
+    session INTEGER NOT NULL,
+    utterance INTEGER,
+    started REAL,
+    ended REAL,
+    language TEXT,
+    model TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_session ON transcripts (run, session, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5 (
+    text, content='transcripts', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS transcripts_ai AFTER INSERT ON transcripts BEGIN
+    INSERT INTO transcripts_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+COLUMNS = ("id", "run", "session", "utterance", "started", "ended", "language", "model", "text")
+MAX_LIMIT = 500
+
+def match_query(query):
+    # every word must appear; FTS5 operators are only honoured with raw=True
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+class TranscriptStore:
+    """Final transcriptions in SQLite, with an FTS5 index over their text.
+
+    Rows are queued by `add` and written in one transaction per `flush_s`, all
+    database work running on a thread of its own so the event loop never waits
+    on the disk. Session ids restart with the engine, so every row also records
+    the run: the time the engine started. Reads flush the queue first, so a
+    transcription is searchable as soon as it has been sent.
+    """
+
+    def __init__(self, path, flush_s=1.0):
+        self.path = path
+        self.flush_s = flush_s
+        self.run = int(time.time())
+        self.pending = []
+        self.flush_handle = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self.conn = self.executor.submit(self._open).result()
+        metrics.gauge("store_pending", lambda: len(self.pending))
+
+    def _open(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def add(self, session, utterance, text, started=None, ended=None, language=None, model=None):
+        self.pending.append((self.run, session, utterance, started, ended, language, model, text))
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_s, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self.flush_handle = None
+        future = self._run(self._flush, self._take())
+        future.add_done_callback(
+            lambda future: future.cancelled() or future.exception() is None
+            or print(f"Transcript store write failed: {future.exception()}"))
+
+    def _take(self):
+        rows, self.pending = self.pending, []
+        return rows
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _flush(self, rows):
+        # on the store thread: one transaction for everything queued since the last flush
+        if not rows:
+            return
+        with metrics.span("store_write"), self.conn:
+            self.conn.executemany(
+                "INSERT INTO transcripts (run, session, utterance, started, ended, language, model, text)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        metrics.count("store_rows", len(rows))
+
+    def _query(self, rows, sql, params):
+        self._flush(rows)
+        return [dict(zip(COLUMNS + ("snippet",), row)) for row in self.conn.execute(sql, params)]
+
+    async def search(self, query, limit=50, before=None, raw=False):
+        # newest first; pass the returned `next` as `before` for the following page
+        if not query.strip():
+            raise ValueError("Empty search query")
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        sql = ("SELECT t.id, t.run, t.session, t.utterance, t.started, t.ended, t.language, t.model, t.text,"
+               " snippet(transcripts_fts, 0, '[', ']', '…', 12)"
+               " FROM transcripts_fts JOIN transcripts t ON t.id = transcripts_fts.rowid"
+               " WHERE transcripts_fts MATCH ? AND t.id < ? ORDER BY t.id DESC LIMIT ?")
+        params = (query if raw else match_query(query), before or 2**63 - 1, limit + 1)
+        with metrics.span("store_search"):
+            results = await self._run(self._query, self._take(), sql, params)
+        return self._page(results, limit)
+
+    async def history(self, session, run=None, limit=50, before=None):
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        sql = ("SELECT id, run, session, utterance, started, ended, language, model, text, NULL"
+               " FROM transcripts WHERE run = ? AND session = ? AND id < ? ORDER BY id DESC LIMIT ?")
+        params = (run or self.run, int(session), before or 2**63 - 1, limit + 1)
+        results = await self._run(self._query, self._take(), sql, params)
+        return self._page(results, limit)
+
+    @staticmethod
+    def _page(results, limit):
+        for result in results:
+            if result["snippet"] is None:
+                del result["snippet"]
+        more = len(results) > limit
+        results = results[:limit]
+        return results, (results[-1]["id"] if more else None)
+
+    async def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        await self._run(self._flush, self._take())
+        await self._run(self.conn.close)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,109 @@
+SAMPLE_RATE = 16000
+
+class LocalAgreement:
+    """Commits words once two consecutive hypotheses agree on them (LocalAgreement-2)."""
+
+    def __init__(self):
+        self.committed = []  # every word committed so far in this utterance
+        self.committed_in_window = []  # committed words whose audio is still in the window
+        self.previous = []  # uncommitted tail of the last hypothesis
+
+    def insert(self, words):
+        # the window still holds audio for words that were already committed, so the
+        # new hypothesis repeats them first; only compare what comes after
+        tail = words[len(self.committed_in_window):]
+        agreed = []
+        for old, new in zip(self.previous, tail):
+            if old != new:
+                break
+            agreed.append(new)
+        self.committed.extend(agreed)
+        self.committed_in_window.extend(agreed)
+        self.previous = tail[len(agreed):]
+        return agreed
+
+    def flush(self, words):
+        tail = words[len(self.committed_in_window):]
+        self.committed.extend(tail)
+        self.committed_in_window.extend(tail)
+        self.previous = []
+        return tail
+
+    def forget(self, count):
+        # the audio behind the first `count` committed words left the window
+        self.committed_in_window = self.committed_in_window[count:]
+
+class StreamingTranscriber:
+    """Rolling-window transcription of one recording with a stable/unstable split.
+
+    The window is a span of the capture ring buffer starting at `start`. The caller
+    decodes `window()` however it likes and passes the pipeline result (a dict with
+    "text" and timestamped "chunks") back to `update` or `finish`.
+    """
+
+    def __init__(self, ring, start, trim_s=15.0, max_window_s=25.0, min_new_s=0.5,
+                 sample_rate=SAMPLE_RATE):
+        self.ring = ring
+        self.start = start
+        self.decoded_end = start  # ring position covered by the last decode
+        self.sample_rate = sample_rate
+        self.trim_s = trim_s
+        self.max_window_s = max_window_s
+        self.min_new_s = min_new_s
+        self.agreement = LocalAgreement()
+        self.degraded = None  # the fallback model, once any decode of the window came from it
+
+    def window_seconds(self):
+        return (self.ring.end - self.start) / self.sample_rate
+
+    def ready(self):
+        return self.ring.end - self.decoded_end >= self.min_new_s * self.sample_rate
+
+    def window(self):
+        self.decoded_end = self.ring.end
+        return {"raw": self.ring.read(self.start, self.decoded_end), "sampling_rate": self.sample_rate}
+
+    def update(self, result):
+        self.degraded = self.degraded or result.get("degraded")
+        self.agreement.insert(result["text"].split())
+        self._trim(result.get("chunks") or [])
+        return self.stable(), " ".join(self.agreement.previous)
+
+    def finish(self, result):
+        # at "off" the window only holds the uncommitted tail of the recording
+        self.degraded = self.degraded or result.get("degraded")
+        self.agreement.flush(result["text"].split())
+        self.start = self.decoded_end
+        return self.stable()
+
+    def stable(self):
+        return " ".join(self.agreement.committed)
+
+    def _trim(self, chunks):
+        if (self.decoded_end - self.start) / self.sample_rate < self.trim_s:
+            return
+        # drop audio up to the end of the last segment whose words are all committed
+        committed = len(self.agreement.committed_in_window)
+        words = 0
+        cut_s, cut_words = None, 0
+        for chunk in chunks[:-1]:  # the last segment may still be growing
+            words += len(chunk["text"].split())
+            end = chunk["timestamp"][1]
+            if words > committed or end is None:
+                break
+            cut_s, cut_words = end, words
+        decoded_s = (self.decoded_end - self.start) / self.sample_rate
+        if cut_s is None and decoded_s >= self.max_window_s and len(chunks) > 1:
+            # nothing agreed for too long: commit everything but the last segment
+            words = sum(len(chunk["text"].split()) for chunk in chunks[:-1])
+            end = chunks[-2]["timestamp"][1]
+            if end is not None:
+                forced = self.agreement.previous[:max(words - committed, 0)]
+                self.agreement.committed.extend(forced)
+                self.agreement.committed_in_window.extend(forced)
+                self.agreement.previous = self.agreement.previous[len(forced):]
+                cut_s, cut_words = end, words
+        if cut_s is None:
+            return
+        self.start = min(self.start + int(cut_s * self.sample_rate), self.decoded_end)
+        self.agreement.forget(cut_words)
@@ -0,0 +1,210 @@
+import asyncio
+import copy
+import functools
+from array import array
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+class EnergyVAD:
+    """Frame classifier on short-time energy and zero-crossing rate.
+
+    A frame is speech when it is loud enough (voiced), or a little quieter but
+    with a high zero-crossing rate (unvoiced consonants such as "s" or "f"), as
+    long as it stands out from the noise floor. The floor follows the quietest
+    frames whatever they were classified as: it drops to them at once and rises
+    by at most `rise_db_s` per second, so steady noise such as hiss sinks under
+    the thresholds within seconds while speech pauses keep pulling it back down.
+    """
+
+    def __init__(self, threshold_db=-45.0, margin_db=10.0, zcr_threshold=0.25, frame_ms=30,
+                 rise_db_s=10.0, sample_rate=SAMPLE_RATE):
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.zcr_threshold = zcr_threshold
+        self.rise_db = rise_db_s * frame_ms / 1000  # per frame
+        self.noise_db = None  # set from the first frames of each recording
+
+    def reset(self):
+        self.noise_db = None
+
+    def classify(self, frames):
+        # frames is (n, frame_size); returns speech flags and frame energies in dBFS
+        energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        crossings = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        quietest = float(energy_db.min())
+        if self.noise_db is None:
+            self.noise_db = min(quietest, self.threshold_db)
+        else:
+            self.noise_db = min(quietest, self.noise_db + self.rise_db * len(frames))
+        threshold = max(self.threshold_db, self.noise_db + self.margin_db)
+        # hiss has a high zero-crossing rate too: fricatives must also clear the floor
+        unvoiced = max(self.threshold_db - self.margin_db, self.noise_db + self.margin_db / 2)
+        speech = (energy_db > threshold) | ((energy_db > unvoiced) & (crossings > self.zcr_threshold))
+        return speech, energy_db
+
+def load_silero():
+    # blocking, and the first call downloads the model from torch.hub: load once, off the event loop
+    import torch
+    model, _ = torch.hub.load("snakers4/silero-vad", "silero_vad", trust_repo=True)
+    return model
+
+class SileroVAD:
+    """Model-based classifier using a Silero VAD model loaded by `load_silero`.
+
+    Each instance works on its own copy of the model (about 2 MB), which holds
+    the recurrent state of one session's audio. Classification runs the model
+    frame by frame, so `blocking` asks the Segmenter to do it on a thread.
+    """
+
+    blocking = True
+
+    def __init__(self, model, threshold=0.5, sample_rate=SAMPLE_RATE):
+        import torch
+        self.torch = torch
+        self.model = copy.deepcopy(model)
+        self.frame_size = 512  # the window size Silero expects at 16 kHz
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    def reset(self):
+        self.model.reset_states()
+
+    def classify(self, frames):
+        with self.torch.no_grad():
+            probs = np.array([self.model(self.torch.from_numpy(frame), self.sample_rate).item()
+                              for frame in frames])
+        energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        return probs > self.threshold, energy_db
+
+def make_vad(kind, threshold_db=-45.0, model=None):
+    # model: the Silero model from load_silero, shared by every session
+    if kind in ("", "off", "none"):
+        return None
+    if kind == "energy":
+        return EnergyVAD(threshold_db)
+    if kind == "silero":
+        if model is None:
+            raise ValueError("The Silero VAD model is not loaded")
+        return SileroVAD(model)
+    raise ValueError(f"Unknown VAD: {kind}")
+
+class Segmenter:
+    """Cuts a recording into speech segments while it is being captured.
+
+    Call `process` whenever audio is written to the ring buffer. Each finished
+    segment is passed to `on_segment(start, end)` as absolute ring positions, with
+    leading/trailing silence trimmed and long silent spans dropped. Segments end
+    at pauses of at least `min_silence_s`, and ones reaching `max_segment_s` are
+    split at their quietest frame, so they can be decoded before "off".
+
+    A blocking VAD classifies on `executor`, one batch of frames at a time, while
+    the event loop keeps running; await `flush` before `finish`.
+    """
+
+    def __init__(self, vad, ring, start, on_segment, min_silence_s=0.5, speech_pad_s=0.2,
+                 min_speech_s=0.25, max_segment_s=30.0, sample_rate=SAMPLE_RATE, executor=None):
+        self.vad = vad
+        self.executor = executor if getattr(vad, "blocking", False) else None
+        self.inflight = None  # classification running on the executor
+        self.closed = False
+        self.vad.reset()
+        self.ring = ring
+        self.start = start
+        self.on_segment = on_segment
+        self.frame = vad.frame_size
+        self.sample_rate = sample_rate
+        self.min_silence = self._frames(min_silence_s)
+        self.pad = int(speech_pad_s * sample_rate / self.frame)
+        self.min_speech = self._frames(min_speech_s)
+        self.max_segment = max(4, self._frames(max_segment_s))
+        self.flags = bytearray()  # speech decision per frame
+        self.energy = array("f")  # energy per frame, to find split points
+        self.segment_start = None  # first speech frame of the open segment
+        self.last_speech = None
+        self.emitted_end = 0  # frame after the last emitted segment
+        self.speech_samples = 0
+
+    def _frames(self, seconds):
+        return max(1, int(seconds * self.sample_rate / self.frame))
+
+    def process(self, inline=False):
+        if self.inflight is not None or self.closed:
+            return  # audio written meanwhile is picked up when the running classification ends
+        done = len(self.flags)
+        count = (self.ring.end - (self.start + done * self.frame)) // self.frame
+        if count <= 0:
+            return
+        pos = self.start + done * self.frame
+        frames = self.ring.read(pos, pos + count * self.frame).reshape(count, self.frame)
+        if self.executor is None or inline:
+            self._classified(done, count, *self.vad.classify(frames))
+            return
+        self.inflight = asyncio.get_running_loop().run_in_executor(self.executor, self.vad.classify, frames)
+        self.inflight.add_done_callback(functools.partial(self._done, done, count))
+
+    def _done(self, done, count, future):
+        self.inflight = None
+        if self.closed or future.cancelled():
+            return
+        if future.exception() is not None:
+            print(f"VAD classification failed: {future.exception()}")
+            return
+        self._classified(done, count, *future.result())
+        self.process()
+
+    def _classified(self, done, count, speech, energy):
+        self.flags.extend(speech.astype(np.uint8).tobytes())
+        self.energy.extend(energy.astype(np.float32))
+        for index in range(done, done + count):
+            self._step(index)
+
+    async def flush(self):
+        # waits for classification on the executor to catch up with the ring
+        while self.inflight is not None:
+            await asyncio.wait([self.inflight])
+
+    def close(self):
+        # the recording was abandoned: results still running on the executor are dropped
+        self.closed = True
+
+    def finish(self):
+        self.process(inline=True)
+        if self.segment_start is not None:
+            self._close(self.segment_start, self.last_speech + 1)
+        return self.skipped_seconds()
+
+    def has_speech(self, start, end):
+        first = max(0, (start - self.start) // self.frame)
+        last = (end - self.start) // self.frame
+        return 1 in self.flags[first:last]
+
+    def skipped_seconds(self):
+        total = min(len(self.flags) * self.frame, self.ring.end - self.start)
+        return max(0, total - self.speech_samples) / self.sample_rate
+
+    def _step(self, index):
+        if self.flags[index]:
+            if self.segment_start is None:
+                self.segment_start = index
+            self.last_speech = index
+        elif self.segment_start is not None and index - self.last_speech >= self.min_silence:
+            self._close(self.segment_start, self.last_speech + 1)
+            return
+        if self.segment_start is not None and index + 1 - self.segment_start >= self.max_segment:
+            # too long without a pause: cut at the quietest frame of the last quarter
+            lo = index + 1 - self.max_segment // 4
+            split = lo + int(np.argmin(self.energy[lo:index + 1]))
+            self._close(self.segment_start, split + 1)
+            self.segment_start = split + 1 if split < index else None
+
+    def _close(self, first, last):
+        self.segment_start = None
+        if sum(self.flags[first:last]) < self.min_speech:
+            return  # a click or a cough, not speech
+        first = max(first - self.pad, self.emitted_end)
+        last = min(last + self.pad, len(self.flags))
+        self.emitted_end = last
+        self.speech_samples += (last - first) * self.frame
+        self.on_segment(self.start + first * self.frame, self.start + last * self.frame)
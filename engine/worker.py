@@ -0,0 +1,39 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+class InferenceWorker:
+    """Runs blocking model calls on a dedicated thread so the event loop stays responsive.
+
+    The models share one thread, so jobs run one at a time in submission order.
+    Every call returns an asyncio future that resolves with the pipeline result.
+    """
+
+    capacity = 1  # batches the scheduler may have in flight at once
+
+    def __init__(self, recognizer, profiler=None):
+        self.recognizer = recognizer
+        self.profiler = profiler
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def transcribe(self, audio, language=None, text_only=True):
+        return self.run(self._profiled, 1, self.recognizer.transcribe, audio, language, text_only)
+
+    def transcribe_batch(self, audios, language=None, tokens=None, recognizer=None):
+        # recognizer overrides the main one, e.g. a faster model while overloaded
+        recognizer = recognizer or self.recognizer
+        return self.run(self._profiled, len(audios), recognizer.transcribe_batch, audios, language, tokens)
+
+    def _profiled(self, utterances, fn, *args):
+        # on the inference thread, so the profile covers the model call itself
+        if self.profiler is None:
+            return fn(*args)
+        with self.profiler.capture(utterances):
+            return fn(*args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
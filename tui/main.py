@@ -1,9 +1,14 @@
+import argparse
 import curses
-import time
 import asyncio
 import os
+import sys
 import json
-from collections import deque
+import wave
+
+# the wire protocol lives with the engine, which owns the socket
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "engine"))
+from protocol import CONTROL, decode_control, encode_audio, encode_control, read_frames
 
 languages = {"english": "en", "chinese": "zh"}
 
@@ -84,13 +89,54 @@ class Pulldown:
         
         self.window.refresh()
 
+class Transcript:
+    """Every message of the session, each held once as a string.
+
+    Nothing is wrapped or laid out here: the view wraps only the entries it
+    shows. A message with a key replaces the earlier message with that key.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}  # key -> index of its entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def add(self, message, key=None):
+        index = self.keys.get(key) if key is not None else None
+        if index is not None:
+            self.entries[index] = message
+            return index
+        self.entries.append(message)
+        if key is not None:
+            self.keys[key] = len(self.entries) - 1
+        return len(self.entries) - 1
+
 class MessageBox:
+    """Scrollable view of a Transcript that repaints only the rows that changed.
+
+    The view is anchored at its bottom row: None follows the newest message,
+    otherwise (entry, rows of that entry hidden below). Messages arriving in
+    a burst are painted together in one frame at most every `frame_s`.
+    """
+
+    frame_s = 1 / 60
+
     def __init__(self, height, width, y, x):
         self.height = height
         self.width = width
         self.y = y
         self.x = x
-        self.messages = deque(maxlen=height)
+        self.transcript = Transcript()
+        self.anchor = None
+        self.shown = [None] * height  # rows as they are on screen
+        self.shown_more = None
+        self.frame = None  # pending frame callback
+        self.last_frame = 0.0
         self.window = None
 
     def create_window(self, stdscr):
@@ -99,75 +145,189 @@ class MessageBox:
         self.window.nodelay(1)  # Make window non-blocking
         self.refresh()
 
-    def add_message(self, message):
+    def add_message(self, message, key=None):
+        self.transcript.add(message, key)
+        self.request_frame()
+
+    def wrap(self, message):
         # Split long messages into multiple lines
-        while len(message) > self.width:
-            self.messages.append(message[:self.width])
-            message = message[self.width:]
-        self.messages.append(message)
-        self.refresh()
+        return [message[i:i + self.width] for i in range(0, len(message), self.width)] or [""]
+
+    def rows(self, anchor=None):
+        # the rows on screen, from the anchor upwards, wrapping no more entries than needed
+        if not len(self.transcript):
+            return []
+        entry, hidden = anchor or self.anchor or (len(self.transcript) - 1, 0)
+        rows = []
+        while entry >= 0 and len(rows) < self.height:
+            lines = self.wrap(self.transcript[entry])
+            rows.extend(reversed(lines[:len(lines) - hidden]))
+            entry, hidden = entry - 1, 0
+        return rows[:self.height][::-1]
+
+    def scroll(self, rows):
+        # positive scrolls back in time, negative towards the newest message
+        if not len(self.transcript):
+            return
+        entry, hidden = self.anchor or (len(self.transcript) - 1, 0)
+        hidden += rows
+        while hidden < 0 and entry < len(self.transcript) - 1:
+            entry += 1
+            hidden += len(self.wrap(self.transcript[entry]))
+        while entry > 0 and hidden >= len(self.wrap(self.transcript[entry])):
+            hidden -= len(self.wrap(self.transcript[entry]))
+            entry -= 1
+        hidden = max(0, min(hidden, len(self.wrap(self.transcript[entry])) - 1))
+        while len(self.rows((entry, hidden))) < self.height and (entry, hidden) != (len(self.transcript) - 1, 0):
+            # scrolled past the first message: come back down a row at a time to keep the screen full
+            if hidden:
+                hidden -= 1
+            else:
+                entry += 1
+                hidden = len(self.wrap(self.transcript[entry])) - 1
+        self.anchor = None if (entry, hidden) == (len(self.transcript) - 1, 0) else (entry, hidden)
+        self.request_frame()
+
+    def scroll_to_end(self):
+        self.anchor = None
+        self.request_frame()
+
+    def request_frame(self):
+        if self.frame is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, self.last_frame + self.frame_s - loop.time())
+        self.frame = loop.call_later(delay, self.refresh)
 
     def refresh(self):
+        if self.frame is not None:
+            self.frame.cancel()
+            self.frame = None
         if not self.window:
             return
-        # Clear the content area (not the border)
-        for i in range(self.height):
-            self.window.addstr(i + 1, 1, " " * self.width)
-        
-        # Print messages
-        for i, msg in enumerate(self.messages):
-            if i < self.height:
-                self.window.addstr(i + 1, 1, msg[:self.width])
-        
-        self.window.box()  # Redraw the border
-        self.window.refresh()
-        curses.doupdate()  # Force an immediate screen update
+        try:
+            self.last_frame = asyncio.get_running_loop().time()
+        except RuntimeError:
+            pass
+        rows = self.rows()
+        rows = [""] * (self.height - len(rows)) + rows
+        changed = False
+        for i, row in enumerate(rows):
+            if self.shown[i] != row:
+                self.window.addstr(i + 1, 1, row.ljust(self.width))
+                self.shown[i] = row
+                changed = True
+        more = self.anchor is not None
+        if more != self.shown_more:
+            self.window.box()
+            if more:
+                self.window.addstr(self.height + 1, 2, " more below, End to follow "[:self.width - 2])
+            self.shown_more = more
+            changed = True
+        if changed:
+            self.window.noutrefresh()
+            curses.doupdate()
+
+class AudioStreamer:
+    """Streams PCM to the engine while a recording is on, so the engine needs no microphone.
+
+    The source is "mic" to capture with arecord on this machine, or the path of
+    a mono S16_LE WAV file that is played in real time.
+    """
 
-async def start_transcription(language_pulldown):
+    frame_ms = 100
+
+    def __init__(self, source):
+        self.source = source
+        self.sample_rate = 16000
+        if source != "mic":
+            with wave.open(source) as wav:
+                if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                    raise ValueError(f"{source}: expected a mono S16_LE WAV file")
+                self.sample_rate = wav.getframerate()
+        self.task = None
+        self.stopping = False
+
+    def start(self, writer):
+        self.stopping = False
+        self.task = asyncio.create_task(self._run(writer))
+
+    async def stop(self):
+        # returns once every captured frame has been written, so "off" follows the audio
+        self.stopping = True
+        if self.task:
+            await self.task
+            self.task = None
+
+    async def _run(self, writer):
+        frame_bytes = self.sample_rate * 2 * self.frame_ms // 1000
+        if self.source == "mic":
+            process = await asyncio.create_subprocess_exec(
+                "arecord", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(self.sample_rate), "-c", "1",
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            try:
+                while not self.stopping:
+                    data = await process.stdout.read(frame_bytes)
+                    if not data:
+                        break
+                    writer.write(encode_audio(data[:len(data) - len(data) % 2], self.sample_rate))
+            finally:
+                if process.returncode is None:
+                    process.terminate()
+                    await process.wait()
+        else:
+            with wave.open(self.source) as wav:
+                while not self.stopping:
+                    data = wav.readframes(frame_bytes // 2)
+                    if not data:
+                        break
+                    writer.write(encode_audio(data, self.sample_rate))
+                    await asyncio.sleep(self.frame_ms / 1000)
+
+def start_transcription(language_pulldown, streamer=None):
     selected_language = language_pulldown.get_selected()
     message = {"event": "on", "type": "transcribe", "language": languages[selected_language]}
-    return json.dumps(message)  # Convert to proper JSON string
+    if streamer:
+        message["source"] = "client"
+        message["sample_rate"] = streamer.sample_rate
+    return message
 
-async def stop_transcription():
+def stop_transcription():
     message = {"event": "off", "type": "transcribe"}
-    return json.dumps(message)
+    return message
 
 async def receive_messages(reader, message_box):
-    async def refresh_loop():
-        while True:
-            message_box.refresh()
-            await asyncio.sleep(0.1)  # 100ms refresh rate
-    
-    refresh_task = asyncio.create_task(refresh_loop())
-    
+    # every message repaints the box itself, there is no periodic refresh
     try:
-        while True:
-            data = await reader.read(1024)
-            if not data:
-                break
-            message = data.decode('utf-8')
-            message_box.add_message(f"Received: {message}")
+        async for kind, payload in read_frames(reader):
+            if kind != CONTROL:
+                continue
+            message = decode_control(payload)
+            if message.get("type") == "transcription" and message.get("utterance") is not None:
+                # drafts and partials are replaced by the final text of the same utterance
+                marker = "" if message.get("final") else " …"
+                message_box.add_message(f"Transcription {message['utterance']}: {message['text'].strip()}{marker}",
+                                        key=(message.get("session"), message["utterance"]))
+            else:
+                message_box.add_message(f"Received: {json.dumps(message)}")
     except ConnectionError:
         message_box.add_message("Peer disconnected")
-    finally:
-        refresh_task.cancel()
-        try:
-            await refresh_task
-        except asyncio.CancelledError:
-            pass
 
-async def send_messages(writer, message_box, event, message_container):
+async def send_messages(writer, message_box, outbox, streamer=None):
     try:
         while True:
-            await event.wait()
-            writer.write(str(message_container['current']).encode('utf-8'))
+            message = await outbox.get()
+            if streamer and message.get('event') == 'off':
+                await streamer.stop()
+            writer.write(encode_control(message))
+            if streamer and message.get('event') == 'on':
+                streamer.start(writer)
             await writer.drain()
-            message_box.add_message(f"Sent: {message_container['current']}")
-            event.clear()
+            message_box.add_message(f"Sent: {json.dumps(message)}")
     except ConnectionError:
         message_box.add_message("Connection lost")
 
-async def main(stdscr):
+async def main(stdscr, audio=None):
     # Initialize curses
     curses.start_color()
     curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_WHITE)
@@ -182,7 +342,7 @@ async def main(stdscr):
         title="TRANSCRIBE",
         height=1,
         width=20,
-        y=height-14,  # 2 lines above message box
+        y=height-11-(len(languages) + 3),  # level with the pulldown's title
         x=(width-20)//2  # centered
     )
     button.create_window(stdscr)
@@ -193,7 +353,9 @@ async def main(stdscr):
         options=languages,
         height=len(languages) + 3,  # +3 for border and title
         width=20,
-        y=height-14,  # Same height as button
+        # open or closed it ends above the message box: both are subwindows of stdscr,
+        # so clearing the pulldown would blank cells the message box thinks it has drawn
+        y=height-12-(len(languages) + 3),
         x=(width-20)//2 - 25  # 25 pixels to the left of button
     )
     language_pulldown.create_window(stdscr)
@@ -211,63 +373,78 @@ async def main(stdscr):
     socket_path = f'{os.getcwd()}/../engine/my_socket.sock'
     reader, writer = await asyncio.open_unix_connection(socket_path)
     
-    message_box.add_message("Connected. Press SPACE to start/stop transcription. Ctrl+C to quit.")
+    message_box.add_message("Connected. Press SPACE to start/stop transcription, arrows and "
+                            "PgUp/PgDn to scroll. Ctrl+C to quit.")
+
+    # messages for send_messages, in the order the keys were pressed
+    outbox = asyncio.Queue()
+    streamer = AudioStreamer(audio) if audio else None
+    recording = False
 
-    # Create an event for communication between input and send_messages
-    event = asyncio.Event()
-    # Create a container for sharing the current message between coroutines
-    message_container = {'current': await start_transcription(language_pulldown)}
+    def handle_key(key):
+        nonlocal recording
+        if key == ord(' '):  # Space bar starts and stops a recording
+            if language_pulldown.is_open:  # Only allow recording if pulldown is closed
+                return
+            recording = not recording
+            button.toggle(recording)
+            if recording:
+                outbox.put_nowait(start_transcription(language_pulldown, streamer))
+                message_box.add_message("Recording started")
+            else:
+                outbox.put_nowait(stop_transcription())
+                message_box.add_message("Recording stopped")
+        elif key == ord('\t'):  # Tab key to toggle pulldown
+            language_pulldown.toggle()
+        elif key == curses.KEY_UP and language_pulldown.is_open:
+            language_pulldown.move_selection(-1)
+        elif key == curses.KEY_DOWN and language_pulldown.is_open:
+            language_pulldown.move_selection(1)
+        elif key == curses.KEY_UP:
+            message_box.scroll(1)
+        elif key == curses.KEY_DOWN:
+            message_box.scroll(-1)
+        elif key == curses.KEY_PPAGE:
+            message_box.scroll(message_box.height - 1)
+        elif key == curses.KEY_NPAGE:
+            message_box.scroll(-(message_box.height - 1))
+        elif key == curses.KEY_END:
+            message_box.scroll_to_end()
+        elif key == ord('\n') and language_pulldown.is_open:  # Enter key
+            language_pulldown.toggle()
+            selected_language = language_pulldown.get_selected()
+            message_box.add_message(f"Selected language: {selected_language}")
 
-    async def handle_input():
+    def handle_input():
+        # called by the event loop only when stdin is readable; handle every key curses has
         while True:
+            key = stdscr.getch()
+            if key == -1:
+                return
             try:
-                key = stdscr.getch()
-                if key == ord(' '):  # Space bar pressed
-                    if not language_pulldown.is_open:  # Only allow recording if pulldown is closed
-                        button.toggle(True)
-                        message_container['current'] = await start_transcription(language_pulldown)
-                        event.set()
-                        message_box.add_message("Recording started")
-                        
-                        # Keep checking until space is released
-                        stdscr.nodelay(1)
-                        while True:
-                            key = stdscr.getch()
-                            if key == ord(' '):  # Space bar released
-                                button.toggle(False)
-                                message_container['current'] = await stop_transcription()
-                                event.set()
-                                message_box.add_message("Recording stopped")
-                                break
-                            await asyncio.sleep(0.01)
-                        stdscr.nodelay(0)
-                elif key == ord('\t'):  # Tab key to toggle pulldown
-                    language_pulldown.toggle()
-                elif key == curses.KEY_UP and language_pulldown.is_open:
-                    language_pulldown.move_selection(-1)
-                elif key == curses.KEY_DOWN and language_pulldown.is_open:
-                    language_pulldown.move_selection(1)
-                elif key == ord('\n') and language_pulldown.is_open:  # Enter key
-                    language_pulldown.toggle()
-                    selected_language = language_pulldown.get_selected()
-                    message_box.add_message(f"Selected language: {selected_language}")
+                handle_key(key)
             except Exception as e:
                 message_box.add_message(f"Input error: {str(e)}")
-            await asyncio.sleep(0.01)
 
+    loop = asyncio.get_running_loop()
+    loop.add_reader(sys.stdin.fileno(), handle_input)
     try:
         await asyncio.gather(
             receive_messages(reader, message_box),
-            send_messages(writer, message_box, event, message_container),
-            handle_input()
+            send_messages(writer, message_box, outbox, streamer),
         )
     finally:
+        loop.remove_reader(sys.stdin.fileno())
         writer.close()
         await writer.wait_closed()
 
 def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--audio", help='stream audio to the engine from "mic" or a WAV file '
+                                        'instead of letting the engine record')
+    args = parser.parse_args()
     try:
-        curses.wrapper(lambda stdscr: asyncio.run(main(stdscr)))
+        curses.wrapper(lambda stdscr: asyncio.run(main(stdscr, args.audio)))
     except KeyboardInterrupt:
         print("\nDisconnecting...")
 